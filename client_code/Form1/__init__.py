@@ -3,12 +3,22 @@ from anvil import *
 import anvil.server
 import anvil.http
 
+STREAM_POLL_INTERVAL = 0.2  # Seconds between timer_stream polls (Timer interval 0 is off)
+
+# Show replies token by token (a background task per reply, polled by
+# timer_stream); otherwise each reply arrives whole from chat_pipeline
+USE_STREAMING = False
+
 class Form1(Form1Template):
 
   def __init__(self, **properties):
     self.init_components(**properties)
     self._last_location = None
     self.current_image_description = None
+    self.stream_id = None
+    self.stream_offset = 0
+    self.stream_text = ""
+    self.chat_before_reply = ""
 
   def timer_image_check_tick(self, **event_args):
     """Poll Runware background image task"""
@@ -47,56 +57,93 @@ class Form1(Form1Template):
       
     self.text_area_chat.text += f"You: {user_msg}\n"
     self.text_box_input.text = ''
+    # Chat text before the reply, which is rewritten as tokens arrive
+    self.chat_before_reply = self.text_area_chat.text
 
     try:
-      # Show a "thinking" indicator
+      # Show a "thinking" indicator until the reply (or its first tokens) arrives
       self.text_area_chat.text += f"Nyx: Thinking...\n"
       
-      # Use the direct processing function
-      result = anvil.server.call('chat_pipeline', user_msg)
-      
-      if result["status"] == "success":
-        # Update chat area - remove "Thinking..." and add the response
-        chat_lines = self.text_area_chat.text.split('\n')
-        if "Nyx: Thinking..." in chat_lines[-1]:
-          chat_lines = chat_lines[:-1]  # Remove the last line
+      if USE_STREAMING:
+        # Stream the reply; timer_stream_tick renders tokens as they arrive
+        result = anvil.server.call('start_chat_stream', user_msg)
         
-        chat_lines.append(f"Nyx: {result['reply']}")
-        self.text_area_chat.text = '\n'.join(chat_lines)
-        
-        # Update thoughts area if any thoughts were extracted
-        if result.get("thoughts"):
-          self.text_area_thoughts.text = '\n\n'.join(result["thoughts"])
-        
-        # Update mood indicator
-        if result.get("mood"):
-          self.label_mood.text = result["mood"]
+        if result["status"] == "started":
+          self.stream_id = result["stream_id"]
+          self.stream_offset = 0
+          self.stream_text = ""
+          self.timer_stream.interval = STREAM_POLL_INTERVAL
         else:
-          self.label_mood.text = "Normal"  # Default mood
-        
-        # Handle image generation if any image requests were found
-        if result.get("images"):
-          self.handle_image_generation(result["images"][0])
-        
+          self.show_error(result['error'])
       else:
-        # Error occurred
-        chat_lines = self.text_area_chat.text.split('\n')
-        if "Nyx: Thinking..." in chat_lines[-1]:
-          chat_lines = chat_lines[:-1]  # Remove the last line
+        # Use the direct processing function
+        result = anvil.server.call('chat_pipeline', user_msg)
         
-        chat_lines.append(f"Error: {result['error']}")
-        self.text_area_chat.text = '\n'.join(chat_lines)
-        self.label_mood.text = "Error"
+        if result["status"] == "success":
+          self.show_reply(result)
+        else:
+          self.show_error(result['error'])
         
     except Exception as e:
       # Update chat to show error
-      chat_lines = self.text_area_chat.text.split('\n')
-      if "Nyx: Thinking..." in chat_lines[-1]:
-        chat_lines = chat_lines[:-1]  # Remove the last line
+      self.show_error(e)
+
+  def timer_stream_tick(self, **event_args):
+    """Poll the streamed reply and render new tokens"""
+    if not self.stream_id:
+      self.timer_stream.interval = 0
+      return
+
+    try:
+      with anvil.server.no_loading_indicator:
+        state = anvil.server.call('read_response_stream', self.stream_id, self.stream_offset)
+      
+      if state["text"]:
+        self.stream_text += state["text"]
+        self.stream_offset = state["offset"]
+        self.set_nyx_line(self.stream_text)
       
-      chat_lines.append(f"Error: {e}")
-      self.text_area_chat.text = '\n'.join(chat_lines)
-      self.label_mood.text = "Error"
+      if state["done"]:
+        self.stop_stream()
+        if state["error"]:
+          self.show_error(state["error"])
+        else:
+          self.show_reply(state["result"])
+          
+    except Exception as e:
+      self.stop_stream()
+      self.show_error(e)
+
+  def stop_stream(self):
+    self.timer_stream.interval = 0
+    self.stream_id = None
+
+  def set_nyx_line(self, text):
+    """Show `text` as the reply in progress (replacing "Thinking..." or earlier tokens)"""
+    self.text_area_chat.text = self.chat_before_reply + f"Nyx: {text}\n"
+
+  def show_reply(self, result):
+    # Replace the streamed text with the final reply (tags parsed out)
+    self.set_nyx_line(result['reply'])
+    
+    # Update thoughts area if any thoughts were extracted
+    if result.get("thoughts"):
+      self.text_area_thoughts.text = '\n\n'.join(result["thoughts"])
+    
+    # Update mood indicator
+    if result.get("mood"):
+      self.label_mood.text = result["mood"]
+    else:
+      self.label_mood.text = "Normal"  # Default mood
+    
+    # Handle image generation if any image requests were found
+    if result.get("images"):
+      self.handle_image_generation(result["images"][0])
+
+  def show_error(self, error):
+    # Replace the reply in progress with the error
+    self.text_area_chat.text = self.chat_before_reply + f"Error: {error}\n"
+    self.label_mood.text = "Error"
 
   def handle_image_generation(self, image_description):
     self.current_image_description = image_description
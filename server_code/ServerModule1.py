@@ -40,6 +40,8 @@ def initialize_memory_system():
                 source="initialization",
                 is_expired=False
             )
+            # Written straight to the table, so drop any cached copy or listing
+            memory_state.invalidate_cached_memory(memory["memory_type"], memory["key"])
             
         return {"status": "Memory system initialized with baseline memories"}
     else:
@@ -1,76 +1,28 @@
 # advanced_memory.py
 import anvil.server
-import json
 import datetime
-from anvil.tables import app_tables
-import httpx
+import heapq
 from . import memory_state
-from . import llm_integration
+from . import ann_index
+from . import extraction_queue
+from .memory_decay import effective_importances, as_utc, utc_now, EXPIRY_THRESHOLD, DECAY_GRACE_DAYS
 
 # Constants for memory management
-MEMORY_DECAY_DAYS = 30  # Memories older than this are less important
+MEMORY_DECAY_DAYS = DECAY_GRACE_DAYS  # Memories older than this are less important (see memory_decay)
 MAX_MEMORIES_PER_TYPE = 50  # Maximum memories to keep per type
+SCAN_PAGE_SIZE = 100  # Rows per page when walking memories in sorted order
+SEMANTIC_ENGINE = "vector"  # "vector" (exact embeddings), "ann" (IVF) or "keyword" (BM25)
 
 @anvil.server.callable
 def extract_memories_using_llm(user_message, assistant_response):
-    """Use the LLM itself to identify and extract memories from conversations"""
-    
-    memory_extraction_prompt = f"""
-    You are an AI designed to extract important information to remember about a user from conversations.
-    
-    USER MESSAGE: {user_message}
-    
-    ASSISTANT RESPONSE: {assistant_response}
-    
-    Please identify any important information to remember about the user from this exchange.
-    Format your response as a JSON object with the following schema:
-    
-    {{
-        "memories": [
-            {{
-                "type": "factual|emotional|preference|interaction",
-                "key": "<memory_category>", 
-                "value": "<specific_information>",
-                "importance": <1-10 score>
-            }}
-        ]
-    }}
-    
-    Only extract information that would be important to remember for future conversations.
-    If no memories should be extracted, return an empty array.
     """
-    
-    payload = {
-        "model": llm_integration.OPENAI_MODEL,
-        "prompt": memory_extraction_prompt,
-        "max_tokens": 512,
-        "temperature": 0.2,
-        "response_format": {"type": "json_object"}
-    }
-    
+    Use the LLM itself to identify and extract memories from conversations.
+    The exchange is queued and extracted together with others in one
+    prompt (see extraction_queue), so this returns without waiting on the LLM.
+    """
     try:
-        response = httpx.post(
-            f"{llm_integration.OPENAI_API_BASE}/completions",
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-        extracted = response.json()["choices"][0]["text"].strip()
-        
-        # Parse the JSON response
-        memory_data = json.loads(extracted)
-        
-        # Save extracted memories
-        for memory in memory_data.get("memories", []):
-            memory_state.save_memory(
-                memory_type=memory["type"],
-                key=memory["key"],
-                value=memory["value"],
-                importance=memory.get("importance", 5)
-            )
-            
-        return {"status": "success", "memories_extracted": len(memory_data.get("memories", []))}
-        
+        pending = extraction_queue.enqueue(user_message, assistant_response)
+        return {"status": "queued", "pending": pending}
     except Exception as e:
         print(f"Memory extraction failed: {e}")
         return {"status": "failed", "error": str(e)}
@@ -81,100 +33,146 @@ def get_memories_by_recency(days=7, limit=10):
     """Get most recent memories, useful for refreshing context"""
     cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
     
-    recent_memories = app_tables.memories.search(
-        tables.order_by("updated_at", ascending=False),
-        updated_at=q.greater_than_or_equal_to(cutoff_date)
-    )
+    # Storage sorts and stops after `limit` rows
+    recent_memories = memory_state.query_memories(
+        order_by="updated_at",
+        limit=limit,
+        updated_since=cutoff_date
+    )["memories"]
     
     return [
         {
-            "type": m["memory_type"],
+            "type": m["type"],
             "key": m["key"],
             "value": m["value"],
-            "updated": m["updated_at"]
+            "updated": m["updated"]
         } 
         for m in recent_memories
-    ][:limit]
+    ]
 
 
 @anvil.server.callable
 def get_memories_by_importance(min_importance=7, limit=10):
-    """Get highest importance memories"""
-    important_memories = app_tables.memories.search(
-        tables.order_by("importance", ascending=False),
-        importance=q.greater_than_or_equal_to(min_importance)
-    )
+    """Get highest importance memories, ranked by decayed (effective) importance"""
+    # Storage walks memories by stored importance. Effective importance can
+    # only be lower, so we can stop once the stored importance of the next
+    # page can no longer beat the current top `limit`.
+    top = []  # min-heap of (effective importance, order, memory)
+    cursor = None
+    order = 0
+    while True:
+        page = memory_state.query_memories(
+            order_by="importance",
+            limit=max(limit, SCAN_PAGE_SIZE),
+            cursor=cursor,
+            min_importance=min_importance,
+            include_expired=False
+        )
+        memories = page["memories"]
+        if not memories:
+            break
+        
+        scores = effective_importances([m["importance"] for m in memories], [m["updated"] for m in memories])
+        for memory, score in zip(memories, scores):
+            if score < min_importance:
+                continue
+            order += 1
+            entry = (float(score), -order, memory)
+            if len(top) < limit:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+        
+        cursor = page["next_cursor"]
+        if not cursor or (len(top) == limit and memories[-1]["importance"] <= top[0][0]):
+            break
     
     return [
         {
-            "type": m["memory_type"],
+            "type": m["type"],
             "key": m["key"],
             "value": m["value"],
-            "importance": m["importance"]
+            "importance": round(score, 2),
+            "base_importance": m["importance"]
         } 
-        for m in important_memories
-    ][:limit]
+        for score, _, m in sorted(top, reverse=True)
+    ]
 
 
 @anvil.server.callable
 def prune_old_memories():
-    """Remove or decay old, less important memories"""
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=MEMORY_DECAY_DAYS)
-    
-    # Find old memories
-    old_memories = app_tables.memories.search(
-        updated_at=q.less_than(cutoff_date),
-        is_expired=q.not_equal_to(True)  # Don't process already expired memories
-    )
-    
-    for memory in old_memories:
-        # If unimportant, mark as expired
-        if memory["importance"] and memory["importance"] < 4:
-            memory["is_expired"] = True
-        # Otherwise decay importance
-        elif memory["importance"]:
-            memory["importance"] = max(1, memory["importance"] - 1)
-    
-    return {"status": "Memory pruning complete", "processed": len(old_memories)}
+    """
+    Expire memories whose decayed importance has fallen below the threshold.
+    
+    Decay itself is computed at read time (see memory_decay), so the only
+    rows written here are the ones that cross the expiry threshold.
+    """
+    cutoff_date = utc_now() - datetime.timedelta(days=MEMORY_DECAY_DAYS)
+    
+    processed = 0
+    expired = 0
+    cursor = None
+    while True:
+        # Oldest first, so we can stop at the first memory still inside the grace period
+        page = memory_state.query_memories(
+            order_by="updated_at",
+            descending=False,
+            limit=SCAN_PAGE_SIZE,
+            cursor=cursor,
+            include_expired=False  # Don't process already expired memories
+        )
+        old_memories = [m for m in page["memories"] if as_utc(m["updated"]) < cutoff_date]
+        processed += len(old_memories)
+        
+        scores = effective_importances([m["importance"] for m in old_memories], [m["updated"] for m in old_memories])
+        for memory, score in zip(old_memories, scores):
+            if score < EXPIRY_THRESHOLD:
+                memory_state.expire_memory(memory["type"], memory["key"])
+                expired += 1
+        
+        cursor = page["next_cursor"]
+        if not cursor or len(old_memories) < len(page["memories"]):
+            break
+    
+    return {"status": "Memory pruning complete", "processed": processed, "expired": expired}
 
 
 @anvil.server.callable
-def get_semantic_memories(query, limit=5):
+def get_semantic_memories(query, limit=5, engine=None):
     """
-    Advanced function (placeholder) for semantic memory search.
-    In a real implementation, this would use embeddings and vector search.
+    Semantic memory search.
     
-    This is a simplified version that uses keyword matching.
+    The "vector" engine embeds the query and scores it against every memory
+    vector in one matrix product; "ann" only scans the nearest IVF partitions
+    (see memory_state.enable_ann_index); the "keyword" engine ranks with BM25.
+    Either way the relevance is weighted by decayed importance and expired memories are skipped.
     """
-    # In a real implementation, you would:
-    # 1. Generate embedding for the query
-    # 2. Compare with stored embeddings
-    # 3. Return closest matches
-    
-    # Simplified implementation with keywords
-    query_words = set(query.lower().split())
-    all_memories = app_tables.memories.search()
-    
-    scored_memories = []
-    for memory in all_memories:
-        if memory["is_expired"]:
+    engine = engine or SEMANTIC_ENGINE
+    if engine not in memory_state.memory_indexes:
+        print(f"Retrieval engine '{engine}' unavailable, falling back to keyword search")
+        engine = "keyword"
+    
+    memory_state.ensure_indexes_built((engine,))
+    
+    # Over-fetch so importance weighting and expiry filtering still leave enough results
+    candidates = memory_state.memory_indexes[engine].search(query, limit * 4)
+    
+    matches = []
+    for relevance, (memory_type, key) in candidates:
+        if relevance <= 0:
             continue
-            
-        memory_text = f"{memory['key']} {memory['value']}".lower()
-        memory_words = set(memory_text.split())
-        
-        # Calculate word overlap
-        overlap = len(query_words.intersection(memory_words))
-        
-        # Add importance weighting
-        importance = memory.get("importance", 5)
-        score = overlap * (importance / 5)
-        
-        if score > 0:
-            scored_memories.append((score, memory))
+        memory = memory_state.get_memory_record(memory_type, key)
+        if not memory or memory["is_expired"]:
+            continue
+        matches.append((relevance, memory))
+    
+    # Add (decayed) importance weighting, computed for all candidates at once
+    importances = effective_importances([m["importance"] for _, m in matches], [m["updated_at"] for _, m in matches])
+    scored_memories = [(relevance * (importance / 5), memory)
+                       for (relevance, memory), importance in zip(matches, importances)]
     
     # Sort by score
-    scored_memories.sort(reverse=True)
+    scored_memories.sort(key=lambda pair: pair[0], reverse=True)
     
     # Return top memories
     return [
@@ -185,4 +183,46 @@ def get_semantic_memories(query, limit=5):
             "score": score
         } 
         for score, m in scored_memories
-    ][:limit]
\ No newline at end of file
+    ][:limit]
+
+
+@anvil.server.callable
+def benchmark_retrieval_engines(num_queries=100, k=10, synthetic_size=0):
+    """
+    Measure recall@k and latency of the ANN engine against exact vector search.
+    
+    By default this runs over the stored memories, using a sample of their own
+    vectors as queries. Pass synthetic_size to benchmark on that many random
+    unit vectors instead (e.g. 1_000_000 to check million-scale behaviour).
+    """
+    if not ann_index.HAS_NUMPY:
+        return {"status": "failed", "error": "numpy not installed"}
+    import numpy as np
+    from .vector_index import VectorIndex
+    
+    rng = np.random.default_rng(0)
+    if synthetic_size:
+        exact = VectorIndex(initial_capacity=synthetic_size)
+        dim = exact.embedder.dim
+        # Clustered data, like real embeddings, rather than uniform noise
+        centers = rng.standard_normal((max(1, synthetic_size // 1000), dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), synthetic_size)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        doc_ids = [("synthetic", str(i)) for i in range(synthetic_size)]
+        exact.add_vectors(doc_ids, vectors)
+        ann = ann_index.IVFIndex(embedder=exact.embedder)
+        ann.add_vectors(doc_ids, vectors)
+    else:
+        memory_state.ensure_indexes_built(("vector",))
+        exact = memory_state.memory_indexes["vector"]
+        ann = memory_state.memory_indexes.get("ann") or memory_state.enable_ann_index()
+        vectors = exact.vectors()
+    
+    if ann.nlist == 1:
+        ann.train()
+    if not len(vectors):
+        return {"status": "failed", "error": "No vectors to benchmark"}
+    
+    queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+    return {"status": "success", **ann_index.benchmark(ann, exact, queries, k)}
@@ -0,0 +1,217 @@
+# ann_index.py
+import heapq
+import itertools
+import time
+
+from .vector_index import VectorIndex, HashingEmbedder, HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# IVF tuning
+ANN_TRAIN_THRESHOLD = 4096  # Stay exact (single list) below this many vectors
+ANN_NPROBE = 8  # Inverted lists scanned per query
+ANN_KMEANS_ITERATIONS = 10
+ANN_KMEANS_SAMPLE = 50000  # Max vectors used to train centroids
+ANN_ASSIGN_CHUNK = 65536  # Rows assigned per matrix product when (re)training
+
+
+def _spherical_kmeans(vectors, n_clusters, iterations, rng):
+    """Cluster unit vectors by cosine similarity; returns normalised centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index.
+
+    Vectors are partitioned by their nearest k-means centroid, and each
+    partition is a VectorIndex (its own contiguous matrix). A query scores
+    the centroids, then only the ANN_NPROBE closest partitions, so cost is
+    roughly nprobe/nlist of a brute-force scan.
+
+    Inserts go straight to the nearest partition and deletes remove the row
+    from its partition. The centroids are retrained whenever the index has
+    doubled in size since the last training, so the number of partitions
+    tracks sqrt(n). Below ANN_TRAIN_THRESHOLD it keeps a single partition
+    and answers exactly.
+    """
+
+    def __init__(self, embedder=None, nprobe=ANN_NPROBE, train_threshold=ANN_TRAIN_THRESHOLD, seed=0):
+        if not HAS_NUMPY:
+            raise RuntimeError("IVFIndex requires numpy")
+        self.embedder = embedder or HashingEmbedder()
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self._rng = np.random.default_rng(seed)
+        self.clear()
+
+    def __len__(self):
+        return len(self._cluster_of)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._cluster_of
+
+    @property
+    def nlist(self):
+        return len(self._lists)
+
+    def doc_ids(self, limit=None):
+        return list(itertools.islice(self._cluster_of.keys(), limit))
+
+    def clear(self):
+        self._centroids = None
+        self._lists = [self._new_list()]
+        self._cluster_of = {}  # doc_id -> partition number
+        self._trained_size = 0
+
+    def set_embedder(self, embedder):
+        """Swap the embedder. The index is emptied and must be rebuilt."""
+        self.embedder = embedder
+        self.clear()
+
+    def _new_list(self, capacity=64):
+        return VectorIndex(embedder=self.embedder, initial_capacity=capacity)
+
+    def _nearest_clusters(self, vectors):
+        if self._centroids is None:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def add(self, doc_id, text):
+        self.add_many([(doc_id, text)])
+
+    def add_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        vectors = self.embedder.embed([text for _, text in items])
+        self.add_vectors([doc_id for doc_id, _ in items], vectors)
+
+    def add_vectors(self, doc_ids, vectors):
+        """Insert precomputed vectors, replacing existing ones with the same id"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for doc_id in doc_ids:
+            self.remove(doc_id)
+
+        clusters = self._nearest_clusters(vectors)
+        for cluster in np.unique(clusters):
+            rows = np.flatnonzero(clusters == cluster)
+            members = [doc_ids[row] for row in rows]
+            self._lists[cluster].add_vectors(members, vectors[rows])
+            for doc_id in members:
+                self._cluster_of[doc_id] = int(cluster)
+
+        size = len(self._cluster_of)
+        if size >= self.train_threshold and size >= 2 * self._trained_size:
+            self.train()
+
+    def remove(self, doc_id):
+        cluster = self._cluster_of.pop(doc_id, None)
+        if cluster is None:
+            return False
+        return self._lists[cluster].remove(doc_id)
+
+    def vectors(self):
+        """All (doc_ids, matrix) currently stored, across partitions"""
+        doc_ids = []
+        blocks = []
+        for partition in self._lists:
+            doc_ids.extend(partition.doc_ids())
+            blocks.append(partition.vectors())
+        if not doc_ids:
+            return [], np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return doc_ids, np.concatenate(blocks)
+
+    def train(self):
+        """(Re)compute centroids and redistribute every vector among the partitions"""
+        doc_ids, matrix = self.vectors()
+        size = len(doc_ids)
+        if not size:
+            return
+
+        start = time.time()
+        n_clusters = max(1, min(size, int(np.sqrt(size))))
+        sample = matrix
+        if size > ANN_KMEANS_SAMPLE:
+            sample = matrix[self._rng.choice(size, ANN_KMEANS_SAMPLE, replace=False)]
+        self._centroids = _spherical_kmeans(sample, n_clusters, ANN_KMEANS_ITERATIONS, self._rng)
+
+        assignment = np.concatenate([
+            self._nearest_clusters(matrix[offset:offset + ANN_ASSIGN_CHUNK])
+            for offset in range(0, size, ANN_ASSIGN_CHUNK)
+        ])
+        counts = np.bincount(assignment, minlength=n_clusters)
+        self._lists = [self._new_list(max(64, int(count))) for count in counts]
+        self._cluster_of = {}
+        order = np.argsort(assignment, kind="stable")
+        boundaries = np.concatenate([[0], np.cumsum(counts)])
+        for cluster in range(n_clusters):
+            rows = order[boundaries[cluster]:boundaries[cluster + 1]]
+            members = [doc_ids[row] for row in rows]
+            self._lists[cluster].add_vectors(members, matrix[rows])
+            for doc_id in members:
+                self._cluster_of[doc_id] = cluster
+
+        self._trained_size = size
+        print(f"Trained IVF index: {size} vectors in {n_clusters} lists ({time.time() - start:.2f}s)")
+
+    def search_vector(self, query_vector, limit=5, nprobe=None):
+        """Return up to `limit` approximate (score, doc_id) pairs, best first"""
+        if not self._cluster_of or limit <= 0:
+            return []
+
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        if self._centroids is None:
+            probes = [0]
+        else:
+            centroid_scores = self._centroids @ query_vector
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        candidates = []
+        for cluster in probes:
+            candidates.extend(self._lists[cluster].search_vector(query_vector, limit))
+        return heapq.nlargest(limit, candidates, key=lambda pair: pair[0])
+
+    def search(self, query, limit=5):
+        if not self._cluster_of:
+            return []
+        return self.search_vector(self.embedder.embed([query])[0], limit)
+
+
+def benchmark(ann, exact, query_vectors, k=10, nprobe_values=(1, 2, 4, 8, 16, 32)):
+    """
+    Compare an IVFIndex against an exact VectorIndex holding the same vectors.
+    Reports mean recall@k and per-query latency for each nprobe setting.
+    """
+    start = time.time()
+    truth = [set(doc_id for _, doc_id in exact.search_vector(q, k)) for q in query_vectors]
+    exact_ms = (time.time() - start) * 1000 / max(1, len(query_vectors))
+
+    results = {"vectors": len(exact), "queries": len(query_vectors), "k": k,
+               "nlist": ann.nlist, "exact_ms_per_query": exact_ms, "ann": []}
+    for nprobe in nprobe_values:
+        if nprobe > ann.nlist:
+            break
+        start = time.time()
+        found = [set(doc_id for _, doc_id in ann.search_vector(q, k, nprobe=nprobe)) for q in query_vectors]
+        ann_ms = (time.time() - start) * 1000 / max(1, len(query_vectors))
+        recall = sum(len(f & t) / max(1, len(t)) for f, t in zip(found, truth)) / max(1, len(truth))
+        results["ann"].append({"nprobe": nprobe, "recall": recall, "ms_per_query": ann_ms,
+                               "speedup": exact_ms / ann_ms if ann_ms else None})
+    return results
@@ -2,10 +2,15 @@
 import anvil.server
 import threading
 import time
-import httpx
 import json
 import re
 from . import memory_state
+from . import post_response
+from . import llm_client
+from . import context_window
+from .prompt_builder import build_prompt, stable_prefix_layout, dynamic_context
+
+MAX_REPLY_TOKENS = 1024
 
 # Global state for response tracking
 response_state = {
@@ -105,12 +110,16 @@ def cancel_processing(response_id=None):
             
     return {"status": "cancelled"}
 
+@memory_state.batched_memory_writes
 def _process_chat_message(user_message, response_id):
     """Process the chat message in a background thread"""
     try:
         # Call the chat model
         from . import llm_integration
         
+        # Make sure the previous turn's memory writes have landed
+        post_response.wait()
+        
         # Build prompt with memories
         if not memory_state.conversation_memory:
             memory_state.conversation_memory.append({
@@ -127,8 +136,11 @@ def _process_chat_message(user_message, response_id):
         # Get relevant memories
         relevant_memories = memory_state.get_relevant_memories(user_message)
         
-        # Add memories to system message
-        if relevant_memories:
+        # Add memories to system message (after the history instead with the stable_prefix layout)
+        turn_context = None
+        if stable_prefix_layout():
+            turn_context = dynamic_context(memories=relevant_memories)
+        elif relevant_memories:
             memory_text = "\nRELEVANT MEMORIES:\n"
             for memory in relevant_memories:
                 memory_text += f"- {memory['type'].upper()}: {memory['value']}\n"
@@ -155,12 +167,11 @@ def _process_chat_message(user_message, response_id):
         # Add user message to conversation
         memory_state.conversation_memory.append({"role": "user", "content": user_message})
 
-        # Select recent context
-        context = memory_state.conversation_memory[-20:]  # Limited window size
+        # Select recent context: system message plus as much history as fits the token budget
+        context = context_window.select_context(memory_state.conversation_memory, MAX_REPLY_TOKENS, turn_context)
 
         # Build prompt
-        from .prompt_builder import build_prompt
-        prompt = build_prompt(context)
+        prompt = build_prompt(context, turn_context)
 
         # Debug info
         print(f"----- Prompt for {response_id} -----")
@@ -176,24 +187,17 @@ def _process_chat_message(user_message, response_id):
         payload = {
             "model": llm_integration.OPENAI_MODEL,
             "prompt": prompt,
-            "max_tokens": 1024,
+            "max_tokens": MAX_REPLY_TOKENS,
             "temperature": 0.7,
-            "stop": ["<end_of_turn>"]
+            "stop": ["<end_of_turn>"],
+            **llm_client.cache_hints()
         }
 
         # Make the API request
         start_time = time.time()
         print(f"Starting LLM request for {response_id} at {start_time}")
         
-        response = httpx.post(
-            f"{llm_integration.OPENAI_API_BASE}/completions",
-            json=payload,
-            timeout=90  # Longer timeout
-        )
-        response.raise_for_status()
-        
-        # Get the raw reply
-        raw_reply = response.json()["choices"][0]["text"].strip()
+        raw_reply = llm_client.complete(payload, timeout=90)  # Long timeout
         
         # Update state with raw reply
         with state_lock:
@@ -215,8 +219,8 @@ def _process_chat_message(user_message, response_id):
             "content": parsed_reply["main_text"]
         })
         
-        # Extract memories from this interaction
-        memory_state.extract_and_save_memories(user_message, parsed_reply["main_text"])
+        # Extract memories from this interaction (queued behind earlier turns)
+        post_response.submit(memory_state.extract_and_save_memories, user_message, parsed_reply["main_text"])
         
         # Log completion
         end_time = time.time()
@@ -0,0 +1,94 @@
+# context_window.py
+import math
+import threading
+from collections import OrderedDict
+
+# Context length of the served model and the share of it a prompt may use:
+# the reply's max_tokens is reserved on top of the prompt
+MODEL_CONTEXT_TOKENS = 8192
+# Turn markers the prompt template adds per message, and once per prompt
+MESSAGE_OVERHEAD_TOKENS = 5
+PROMPT_OVERHEAD_TOKENS = 8
+
+# Token estimate: characters per token, recalibrated from the prompt token
+# counts the server reports (see calibrate)
+DEFAULT_CHARS_PER_TOKEN = 3.5
+CALIBRATION_WEIGHT = 0.2  # Weight of each new observation in the running ratio
+TOKEN_CACHE_SIZE = 4096
+
+_lock = threading.Lock()
+_chars_per_token = DEFAULT_CHARS_PER_TOKEN
+_token_cache = OrderedDict()  # message text -> estimated tokens
+stats = {"counted": 0, "cache_hits": 0, "calibrations": 0}
+
+
+def estimate_tokens(text):
+    """Estimated token count of `text` (before per-message overhead)"""
+    return math.ceil(len(text) / _chars_per_token) if text else 0
+
+
+def message_tokens(message):
+    """Tokens one message adds to a prompt, counted once per distinct text"""
+    content = message["content"] or ""
+    with _lock:
+        tokens = _token_cache.get(content)
+        if tokens is not None:
+            _token_cache.move_to_end(content)
+            stats["cache_hits"] += 1
+            return tokens
+    tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+    with _lock:
+        stats["counted"] += 1
+        _token_cache[content] = tokens
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
+
+
+def calibrate(prompt, prompt_tokens):
+    """Fold a server-reported prompt token count into the estimator"""
+    global _chars_per_token
+    if not prompt or not prompt_tokens:
+        return
+    observed = len(prompt) / prompt_tokens
+    with _lock:
+        updated = (1 - CALIBRATION_WEIGHT) * _chars_per_token + CALIBRATION_WEIGHT * observed
+        # Cached counts were made with the old ratio; drop them once it moves noticeably
+        if abs(updated - _chars_per_token) / _chars_per_token > 0.05:
+            _token_cache.clear()
+        _chars_per_token = updated
+        stats["calibrations"] += 1
+
+
+def context_budget(reply_tokens):
+    """Tokens available for messages when `reply_tokens` are reserved for the reply"""
+    return MODEL_CONTEXT_TOKENS - reply_tokens - PROMPT_OVERHEAD_TOKENS
+
+
+def select_context(messages, reply_tokens, extra_text=None):
+    """
+    The messages to render into a prompt: the system message (always kept)
+    followed by as many of the most recent messages as fit the budget,
+    in their original order. The newest message is kept even if it alone
+    exceeds the budget. `extra_text` is anything else rendered into the
+    prompt (e.g. the per-turn context block); its tokens are reserved too.
+    """
+    budget = context_budget(reply_tokens)
+    if extra_text:
+        budget -= message_tokens({"content": extra_text})
+    system = []
+    history = messages
+    if messages and messages[0]["role"] == "system":
+        system = [messages[0]]
+        history = messages[1:]
+        budget -= message_tokens(messages[0])
+
+    selected = []
+    for message in reversed(history):
+        tokens = message_tokens(message)
+        if selected and tokens > budget:
+            break
+        selected.append(message)
+        budget -= tokens
+    selected.reverse()
+    return system + selected
@@ -0,0 +1,149 @@
+# embedding_client.py
+import base64
+import hashlib
+import json
+import os
+import threading
+
+import anvil.server
+
+from . import llm_integration
+from . import llm_client
+from . import memory_state
+from .vector_index import HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# --- Configuration ---
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", llm_integration.OPENAI_MODEL)
+EMBEDDING_BATCH_SIZE = 64  # Texts per /embeddings request
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache.jsonl")
+
+
+def content_hash(model, text):
+    """Cache key for one text under one embedding model"""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embedding vectors keyed by content hash, persisted to an append-only
+    JSON-lines sidecar file. Each line holds one hash and its float32 vector
+    (base64 encoded). The whole file is loaded once, so after a restart
+    unchanged memories are re-indexed without any embedding requests.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._vectors = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    raw = base64.b64decode(entry["vector"])
+                    self._vectors[entry["hash"]] = np.frombuffer(raw, dtype=np.float32)
+            print(f"Loaded {len(self._vectors)} cached embeddings from {self.path}")
+        except Exception as e:
+            print(f"Error loading embedding cache: {e}")
+
+    def get(self, digest):
+        return self._vectors.get(digest)
+
+    def put_many(self, entries):
+        """Store (digest, vector) pairs in memory and append them to the sidecar file"""
+        with self._lock:
+            lines = []
+            for digest, vector in entries:
+                vector = np.asarray(vector, dtype=np.float32)
+                self._vectors[digest] = vector
+                lines.append(json.dumps({
+                    "hash": digest,
+                    "vector": base64.b64encode(vector.tobytes()).decode("ascii")
+                }))
+            if not self.path or not lines:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except Exception as e:
+                print(f"Error writing embedding cache: {e}")
+
+
+class EmbeddingClient:
+    """
+    Embedder backed by the `/embeddings` endpoint of the OpenAI-compatible
+    server at OPENAI_API_BASE.
+
+    Texts missing from the cache are de-duplicated and sent in batches of
+    EMBEDDING_BATCH_SIZE; vectors are L2-normalised so dot products are cosine
+    similarities. Implements the embedder interface used by VectorIndex.
+    """
+
+    def __init__(self, model=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE, cache=None):
+        if not HAS_NUMPY:
+            raise RuntimeError("EmbeddingClient requires numpy")
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self._dim = None
+        self.stats = {"requests": 0, "embedded": 0, "cache_hits": 0}
+
+    @property
+    def dim(self):
+        if self._dim is None:
+            self._dim = len(self.embed(["dimension probe"])[0])
+        return self._dim
+
+    def _request(self, texts):
+        response = llm_client.post("/embeddings", {"model": self.model, "input": texts},
+                                   timeout=llm_integration.TIMEOUT)
+        self.stats["requests"] += 1
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def embed(self, texts):
+        digests = [content_hash(self.model, text) for text in texts]
+
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if self.cache.get(digest) is None:
+                missing.setdefault(digest, text)
+        self.stats["cache_hits"] += len(texts) - len(missing)
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            vectors = np.asarray(self._request([text for _, text in batch]), dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+            self.cache.put_many(zip((digest for digest, _ in batch), vectors))
+            self.stats["embedded"] += len(batch)
+
+        if not texts:
+            return np.zeros((0, self._dim or 0), dtype=np.float32)
+        result = np.stack([self.cache.get(digest) for digest in digests])
+        self._dim = result.shape[1]
+        return result
+
+
+@anvil.server.callable
+def enable_remote_embeddings(model=None):
+    """Use the server's /embeddings endpoint for the vector memory index and re-index"""
+    client = EmbeddingClient(model=model or EMBEDDING_MODEL)
+    memory_state.use_embedder(client)
+    memory_state.ensure_indexes_built(("vector", "ann"))
+    return {"status": "success", "indexed": len(memory_state.memory_indexes["vector"]), "stats": dict(client.stats)}
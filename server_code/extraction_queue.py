@@ -0,0 +1,207 @@
+# extraction_queue.py
+import datetime
+import json
+import threading
+import time
+import anvil.server
+
+from . import memory_state
+from . import llm_integration
+from . import llm_client
+
+# Exchanges waiting for LLM memory extraction are flushed once a batch is
+# queued, or once EXTRACTION_FLUSH_INTERVAL seconds have passed since the
+# last flush; the scheduled task (see anvil.yaml) also flushes every 5 minutes
+EXTRACTION_BATCH_SIZE = 8  # Exchanges per extraction prompt
+EXTRACTION_FLUSH_INTERVAL = 300
+EXTRACTION_TIME_BUDGET = 120  # Seconds one flush may keep sending batches
+EXTRACTION_TIMEOUT = 60
+EXTRACTION_TOKENS_PER_EXCHANGE = 192
+EXTRACTION_MESSAGE_CHARS = 1000  # Longest message excerpt put in the prompt
+
+EXTRACTABLE_TYPES = ("factual", "emotional", "preference", "interaction")
+
+# Queued exchanges are kept in the "extraction_queue" log of the memory storage backend
+EXTRACTION_LOG = "extraction_queue"
+
+_flushing = threading.Lock()
+_last_flush = time.time()
+
+
+def _pending_count():
+    return memory_state.backend.log_count(EXTRACTION_LOG)
+
+
+def enqueue(user_message, assistant_response):
+    """Queue one exchange for extraction. Returns the number of exchanges now pending."""
+    exchange = {
+        "created_at": datetime.datetime.now(),
+        "user_message": user_message or "",
+        "assistant_response": assistant_response or "",
+    }
+    memory_state.backend.log_append(EXTRACTION_LOG, [exchange])
+    pending = _pending_count()
+    if pending >= EXTRACTION_BATCH_SIZE or time.time() - _last_flush >= EXTRACTION_FLUSH_INTERVAL:
+        _launch_flush()
+    return pending
+
+
+def _launch_flush():
+    """Flush in a background task so the caller never waits on the LLM"""
+    global _last_flush
+    _last_flush = time.time()
+    try:
+        anvil.server.launch_background_task("memory_extraction_task")
+    except Exception as e:
+        print(f"Could not launch memory extraction task ({e}), flushing here")
+        flush()
+
+
+def _claim(limit):
+    """Take up to `limit` of the oldest queued exchanges off the queue (atomically, see log_take)"""
+    return memory_state.backend.log_take(EXTRACTION_LOG, limit)
+
+
+def _requeue(exchanges):
+    """Put claimed exchanges back (e.g. after a failed extraction call)"""
+    memory_state.backend.log_append(EXTRACTION_LOG, exchanges)
+
+
+def _extraction_prompt(exchanges):
+    sections = []
+    for number, exchange in enumerate(exchanges, 1):
+        sections.append(
+            f"EXCHANGE {number}:\n"
+            f"USER MESSAGE: {exchange['user_message'][:EXTRACTION_MESSAGE_CHARS]}\n"
+            f"ASSISTANT RESPONSE: {exchange['assistant_response'][:EXTRACTION_MESSAGE_CHARS]}"
+        )
+
+    return f"""
+    You are an AI designed to extract important information to remember about a user from conversations.
+
+    {chr(10).join(sections)}
+
+    For each exchange, identify any important information to remember about the user.
+    Format your response as a JSON object with the following schema:
+
+    {{
+        "exchanges": [
+            {{
+                "exchange": <exchange number>,
+                "memories": [
+                    {{
+                        "type": "factual|emotional|preference|interaction",
+                        "key": "<memory_category>",
+                        "value": "<specific_information>",
+                        "importance": <1-10 score>
+                    }}
+                ]
+            }}
+        ]
+    }}
+
+    Only extract information that would be important to remember for future conversations.
+    Use an empty memories array for an exchange with nothing worth remembering.
+    """
+
+
+def _extract(exchanges):
+    """One completion call for a batch. Returns {exchange number: [memory dicts]}."""
+    text = llm_client.complete(
+        {
+            "model": llm_integration.OPENAI_MODEL,
+            "prompt": _extraction_prompt(exchanges),
+            "max_tokens": EXTRACTION_TOKENS_PER_EXCHANGE * len(exchanges),
+            "temperature": 0.2,
+            "response_format": {"type": "json_object"}
+        },
+        timeout=EXTRACTION_TIMEOUT
+    )
+    data = json.loads(text)
+
+    results = {}
+    for item in data.get("exchanges", []):
+        try:
+            number = int(item.get("exchange"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= len(exchanges):
+            results.setdefault(number, []).extend(_valid_memories(item.get("memories")))
+    return results
+
+
+def _valid_memories(memories):
+    """Memories from the model's output that can be saved as they are"""
+    valid = []
+    for memory in memories or []:
+        if not isinstance(memory, dict) or memory.get("type") not in EXTRACTABLE_TYPES:
+            continue
+        if not memory.get("key") or not memory.get("value"):
+            continue
+        try:
+            importance = min(10, max(1, int(memory.get("importance", 5))))
+        except (TypeError, ValueError):
+            importance = 5
+        valid.append({"type": memory["type"], "key": str(memory["key"]),
+                      "value": str(memory["value"]), "importance": importance})
+    return valid
+
+
+def flush(time_budget=EXTRACTION_TIME_BUDGET):
+    """
+    Extract memories from queued exchanges, one prompt per
+    EXTRACTION_BATCH_SIZE exchanges, until the queue is empty or the time
+    budget is spent. Memories are saved in one batched write per prompt.
+    """
+    global _last_flush
+    report = {"exchanges": 0, "memories": 0, "batches": 0, "failed_batches": 0}
+    if not _flushing.acquire(blocking=False):
+        return dict(report, status="busy")  # Another flush in this process is already running
+
+    _last_flush = time.time()
+    try:
+        deadline = time.time() + time_budget
+        while time.time() < deadline:
+            exchanges = _claim(EXTRACTION_BATCH_SIZE)
+            if not exchanges:
+                break
+            try:
+                results = _extract(exchanges)
+            except Exception as e:
+                print(f"Memory extraction failed: {e}")
+                _requeue(exchanges)
+                report["failed_batches"] += 1
+                break
+
+            with memory_state.memory_batch():
+                for memories in results.values():
+                    for memory in memories:
+                        memory_state.save_memory(
+                            memory_type=memory["type"],
+                            key=memory["key"],
+                            value=memory["value"],
+                            importance=memory["importance"]
+                        )
+                        report["memories"] += 1
+            report["exchanges"] += len(exchanges)
+            report["batches"] += 1
+    finally:
+        _flushing.release()
+
+    if report["exchanges"]:
+        print(f"Extracted {report['memories']} memories from {report['exchanges']} exchanges "
+              f"in {report['batches']} prompts")
+    return dict(report, status="success" if not report["failed_batches"] else "failed",
+                pending=_pending_count())
+
+
+@anvil.server.background_task
+def memory_extraction_task():
+    """Scheduled task (see anvil.yaml) and size-triggered flush of the extraction queue"""
+    return flush()
+
+
+@anvil.server.callable
+def flush_memory_extraction():
+    """Extract memories from everything queued right now"""
+    return flush()
@@ -0,0 +1,123 @@
+# keyword_index.py
+import heapq
+import itertools
+import math
+import re
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# BM25 tuning parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words too common to say anything about what a memory is about
+STOPWORDS = frozenset("""
+a about an and are as at be but by can did do does for from had has have how i i'm if in is it it's
+me my of on or so that the their them they this to was we were what when where which who why will
+with you you're your
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and querying"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def content_terms(text):
+    """tokenize(text) without stopwords"""
+    return [term for term in tokenize(text) if term not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incremental inverted index with BM25 scoring.
+
+    Each document is added under an id (we use (memory_type, key)). The index
+    keeps term -> {doc_id: term frequency} postings, per-document lengths and
+    the running total length, so adds and removes only touch the terms of the
+    document involved. A query only visits the postings of its own terms.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> {doc_id: tf}
+        self._doc_terms = {}  # doc_id -> Counter of terms (needed for removal)
+        self._doc_lengths = {}  # doc_id -> number of tokens
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_terms
+
+    def doc_ids(self, limit=None):
+        """Document ids in insertion order"""
+        return list(itertools.islice(self._doc_terms.keys(), limit))
+
+    def document_frequency(self, term):
+        return len(self._postings.get(term, ()))
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._total_length = 0
+
+    def add(self, doc_id, text):
+        """Index a document, replacing any previous version with the same id"""
+        if doc_id in self._doc_terms:
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def add_many(self, items):
+        """Index a batch of (doc_id, text) pairs"""
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+        return True
+
+    def search(self, query, limit=5):
+        """Return up to `limit` (score, doc_id) pairs, best first"""
+        doc_count = len(self._doc_terms)
+        if not doc_count:
+            return []
+
+        avg_length = self._total_length / doc_count or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+
+            df = len(posting)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(limit, ((score, doc_id) for doc_id, score in scores.items()),
+                              key=lambda pair: pair[0])
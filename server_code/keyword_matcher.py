@@ -0,0 +1,94 @@
+# keyword_matcher.py
+import re
+
+# Keyword categories used by memory extraction. Terms match whole words
+# only (case-insensitive); a space in a term matches any run of whitespace.
+KEYWORD_CATEGORIES = {
+    "preference": ["like", "love", "hate", "prefer", "favorite", "enjoy"],
+    "emotion": ["happy", "sad", "angry", "excited", "worried", "anxious", "longing"],
+    "personal": ["i am", "i'm", "my"],
+}
+
+
+def _trie_pattern(node):
+    """Regex for a character trie, sharing prefixes so matching never re-scans a term list"""
+    terminal = "" in node
+    branches = []
+    for char in sorted(ch for ch in node if ch):
+        atom = r"\s+" if char == " " else re.escape(char)
+        branches.append(atom + _trie_pattern(node[char]))
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if terminal:
+        return "(?:" + body + ")?"
+    return body
+
+
+class KeywordMatcher:
+    """
+    Classifies text against many keyword categories in one scan.
+
+    All terms of all categories are compiled into a single word-bounded
+    regex built from a trie of the terms, so the cost of a match grows with
+    the length of the text rather than the number of terms.
+    """
+
+    def __init__(self, categories=None):
+        self.categories = {}
+        self._pattern = None
+        self.configure(categories if categories is not None else KEYWORD_CATEGORIES)
+
+    def configure(self, categories):
+        """Replace the keyword sets ({category: [terms]}) and recompile"""
+        self.categories = {category: [term.lower() for term in terms] for category, terms in categories.items()}
+        self._compile()
+
+    def add_terms(self, category, terms):
+        self.categories.setdefault(category, []).extend(term.lower() for term in terms)
+        self._compile()
+
+    def _compile(self):
+        self._term_categories = {}  # normalised term -> categories containing it
+        trie = {}
+        for category, terms in self.categories.items():
+            for term in terms:
+                term = " ".join(term.split())
+                if not term:
+                    continue
+                self._term_categories.setdefault(term, []).append(category)
+                node = trie
+                for char in term:
+                    node = node.setdefault(char, {})
+                node[""] = True
+
+        if not trie:
+            self._pattern = None
+            return
+        self._pattern = re.compile(r"(?<!\w)" + _trie_pattern(trie) + r"(?!\w)", re.IGNORECASE)
+
+    def match(self, text):
+        """{category: [terms found, in order of first appearance]} for the categories present in text"""
+        found = {}
+        if not text or self._pattern is None:
+            return found
+        for match in self._pattern.finditer(text):
+            term = " ".join(match.group(0).lower().split())
+            for category in self._term_categories.get(term, ()):
+                terms = found.setdefault(category, [])
+                if term not in terms:
+                    terms.append(term)
+        return found
+
+
+# Built once at import; see configure_keywords to change the sets
+default_matcher = KeywordMatcher()
+
+
+def classify(text):
+    return default_matcher.match(text)
+
+
+def configure_keywords(categories):
+    """Replace the keyword categories used by memory extraction"""
+    default_matcher.configure(categories)
@@ -0,0 +1,198 @@
+# llm_client.py
+import json
+import threading
+import time
+from collections import OrderedDict
+import anvil.server
+import httpx
+
+from . import llm_integration
+from . import context_window
+from . import post_response
+from .response_cache import default_cache as response_cache, cacheable
+
+# Connection pool shared by every call to the LLM server. Idle connections
+# are kept alive so consecutive requests skip the TCP/TLS handshake.
+MAX_CONNECTIONS = 10
+MAX_KEEPALIVE_CONNECTIONS = 5
+KEEPALIVE_EXPIRY = 60  # Seconds an idle connection stays in the pool
+CONNECT_TIMEOUT = 5
+
+# Prefix-cache hints for llama.cpp-style servers: keep each chat session's
+# prompt in the KV cache (cache_prompt) and pin the session to one server
+# slot (id_slot), so the next turn only prefills what is new. Off by
+# default, as other servers may reject the extra fields.
+SEND_CACHE_HINTS = False
+CACHE_SLOTS = 4  # Parallel slots the server runs (llama.cpp --parallel)
+
+_client = None
+_client_lock = threading.Lock()
+_stats_lock = threading.Lock()
+stats = {"requests": 0, "new_connections": 0, "reused_connections": 0, "errors": 0, "seconds": 0.0,
+         "prompt_tokens": 0, "cached_prompt_tokens": 0}
+_session_slots = OrderedDict()  # session_id -> slot, least recently used first
+
+
+def get_client():
+    """The process-wide pooled client (created on first use)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                        keepalive_expiry=KEEPALIVE_EXPIRY),
+                    timeout=httpx.Timeout(llm_integration.TIMEOUT, connect=CONNECT_TIMEOUT),
+                )
+    return _client
+
+
+def close():
+    """Close pooled connections (e.g. after changing the pool limits)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _timeout(timeout):
+    return httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout)) if timeout else httpx.USE_CLIENT_DEFAULT
+
+
+class _ConnectionTrace:
+    """httpcore trace hook noting whether a request had to open a new connection"""
+
+    def __init__(self):
+        self.connected = False
+
+    def __call__(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.connected = True
+
+
+def _record(trace, started, failed=False):
+    with _stats_lock:
+        stats["requests"] += 1
+        stats["seconds"] += time.time() - started
+        if failed:
+            stats["errors"] += 1  # May not have reached a connection at all
+        else:
+            stats["new_connections" if trace.connected else "reused_connections"] += 1
+
+
+def post(path, payload, timeout=None):
+    """
+    POST `payload` as JSON to `path` under OPENAI_API_BASE (e.g.
+    "/completions") on a pooled connection. Returns the response; raises
+    for HTTP errors. `timeout` overrides the default read timeout.
+    """
+    trace = _ConnectionTrace()
+    started = time.time()
+    try:
+        response = get_client().post(f"{llm_integration.OPENAI_API_BASE}{path}", json=payload,
+                                     timeout=_timeout(timeout), extensions={"trace": trace})
+        response.raise_for_status()
+    except Exception:
+        _record(trace, started, failed=True)
+        raise
+    _record(trace, started)
+    return response
+
+
+def complete(payload, timeout=None):
+    """
+    Text of the first choice of a /completions request. Identical
+    low-temperature requests are answered from the response cache.
+    """
+    cached = response_cache.lookup(payload)
+    if cached is not None:
+        return cached["raw_reply"]
+
+    data = post("/completions", payload, timeout).json()
+    # Servers that report usage keep the context window's token estimate calibrated
+    usage = data.get("usage") or {}
+    context_window.calibrate(payload.get("prompt"), usage.get("prompt_tokens"))
+    _record_prefill(usage, data.get("timings") or {})
+    text = data["choices"][0]["text"].strip()
+    if cacheable(payload):
+        response_cache.put({"raw_reply": text}, payload=payload)
+    return text
+
+
+def _record_prefill(usage, timings):
+    """Prompt tokens reported by the server, and how many came from its prefix cache"""
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", timings.get("cache_n"))
+    with _stats_lock:
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["cached_prompt_tokens"] += cached or 0
+
+
+def cache_hints(session_id=post_response.DEFAULT_CONVERSATION_ID):
+    """Extra payload fields asking the server to reuse `session_id`'s cached prompt prefix"""
+    if not SEND_CACHE_HINTS:
+        return {}
+    with _stats_lock:
+        slot = _session_slots.pop(session_id, None)
+        if slot is None:
+            used = set(_session_slots.values())
+            free = [s for s in range(CACHE_SLOTS) if s not in used]
+            # Every slot taken: the least recently active session gives up its slot
+            slot = free[0] if free else _session_slots.pop(next(iter(_session_slots)))
+        _session_slots[session_id] = slot
+    return {"cache_prompt": True, "id_slot": slot}
+
+
+def stream_completion(payload, timeout=None):
+    """
+    Stream a /completions request (server-sent events), yielding each text
+    chunk as it arrives. `timeout` bounds the wait between chunks. Usage
+    reported at the end of the stream is recorded like complete()'s.
+    """
+    trace = _ConnectionTrace()
+    started = time.time()
+    usage, timings = {}, {}
+    try:
+        with get_client().stream("POST", f"{llm_integration.OPENAI_API_BASE}/completions",
+                                 json=dict(payload, stream=True, stream_options={"include_usage": True}),
+                                 timeout=_timeout(timeout), extensions={"trace": trace}) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError as e:
+                    print(f"Error parsing stream chunk: {e}")
+                    continue
+                # The final chunk(s) carry usage (OpenAI) or timings (llama.cpp)
+                usage = chunk.get("usage") or usage
+                timings = chunk.get("timings") or timings
+                choices = chunk.get("choices") or []
+                text = choices[0].get("text") if choices else None
+                if text:
+                    yield text
+    except Exception:
+        _record(trace, started, failed=True)
+        raise
+    _record(trace, started)
+    context_window.calibrate(payload.get("prompt"), usage.get("prompt_tokens"))
+    _record_prefill(usage, timings)
+
+
+@anvil.server.callable
+def get_llm_client_stats():
+    """Request counts, connection reuse and average latency of LLM calls in this process"""
+    with _stats_lock:
+        current = dict(stats)
+    requests = current["requests"]
+    return dict(current,
+                cached_prompt_share=current["cached_prompt_tokens"] / current["prompt_tokens"]
+                if current["prompt_tokens"] else None,
+                reuse_rate=current["reused_connections"] / (requests - current["errors"])
+                if requests > current["errors"] else None,
+                average_seconds=current["seconds"] / requests if requests else None)
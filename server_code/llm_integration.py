@@ -1,16 +1,18 @@
 # llm_integration.py
 
 import anvil.server
-import httpx
 import json
 import time
 from . import memory_state
-from .prompt_builder import build_prompt
+from . import post_response
+from . import llm_client
+from . import context_window
+from .prompt_builder import build_prompt, stable_prefix_layout, dynamic_context
 
 # --- Configuration ---
 OPENAI_API_BASE = "http://localhost:5000/v1"
 OPENAI_MODEL = "your-model-name"  # e.g. "gpt-4", "mistral", "gemma", etc.
-MAX_MESSAGES = 20
+MAX_REPLY_TOKENS = 512  # Reserved for the reply when fitting history into the context
 TIMEOUT = 60
 USE_STREAMING = False
 
@@ -28,6 +30,13 @@ NYX_APPEARANCE = (
     "You may be visualized in images when referenced as 'me', 'myself', or similar."
 )
 
+# Persona-only system message; the mood and memories of each turn are added
+# elsewhere (after the history, or into the message itself, see prompt_builder)
+DEFAULT_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "\n\n".join([DEFAULT_PERSONA, NYX_APPEARANCE])
+}
+
 # --- System Message Builder ---
 
 def build_system_message(mood=None, relevant_memories=None):
@@ -50,26 +59,36 @@ def build_system_message(mood=None, relevant_memories=None):
 # --- Core Chat Function ---
 
 @anvil.server.callable
+@memory_state.batched_memory_writes
 def chat_with_model(user_message):
     if not user_message.strip():
         return {"reply": "[ERROR] Empty message."}
 
+    # Make sure the previous turn's memory writes have landed
+    post_response.wait()
+
     # Retrieve relevant memories
     relevant_memories = memory_state.get_relevant_memories(user_message)
 
     # Insert system message if not present
-    if not memory_state.conversation_memory or memory_state.conversation_memory[0]['role'] != 'system':
+    turn_context = None
+    if stable_prefix_layout():
+        # Keep the system message byte-identical across turns; memories go after the history
+        if not memory_state.conversation_memory or memory_state.conversation_memory[0]['role'] != 'system':
+            memory_state.conversation_memory.insert(0, build_system_message())
+        turn_context = dynamic_context(memories=relevant_memories)
+    elif not memory_state.conversation_memory or memory_state.conversation_memory[0]['role'] != 'system':
         system_msg = build_system_message(relevant_memories=relevant_memories)
         memory_state.conversation_memory.insert(0, system_msg)
 
     # Add user input
     memory_state.conversation_memory.append({"role": "user", "content": user_message})
 
-    # Select context window
-    context = memory_state.conversation_memory[-MAX_MESSAGES:]
+    # Select context window: system message plus as much recent history as fits
+    context = context_window.select_context(memory_state.conversation_memory, MAX_REPLY_TOKENS, turn_context)
 
     # Build the full prompt using your Jinja2 template
-    prompt = build_prompt(context)
+    prompt = build_prompt(context, turn_context)
 
     print("----- Rendered Prompt Start -----")
     print(prompt)
@@ -88,9 +107,10 @@ def chat_with_model(user_message):
     payload = {
         "model": OPENAI_MODEL,
         "prompt": prompt,
-        "max_tokens": 512,
+        "max_tokens": MAX_REPLY_TOKENS,
         "temperature": 0.8,
-        "stop": ["<end_of_turn>"]
+        "stop": ["<end_of_turn>"],
+        **llm_client.cache_hints()
     }
 
     try:
@@ -98,41 +118,15 @@ def chat_with_model(user_message):
         print(f"Starting LLM request at {start_time}")
 
         if USE_STREAMING:
-            reply = ""
-            response = httpx.post(
-                f"{OPENAI_API_BASE}/completions",
-                json={key: value for key, value in payload.items() if key != "stream"},
-                timeout=TIMEOUT,
-            )
-            response.raise_for_status()
-
-            for line in response.iter_lines():
-                if not line.strip():
-                    continue
-                try:
-                    if line.startswith(b"data: "):
-                        json_str = line[6:].decode("utf-8")
-                        if json_str == "[DONE]":
-                            break
-                        chunk = json.loads(json_str)
-                        if chunk["choices"][0].get("text"):
-                            reply += chunk["choices"][0]["text"]
-                except Exception as e:
-                    print(f"Error parsing stream chunk: {e}")
+            reply = "".join(llm_client.stream_completion(payload, timeout=TIMEOUT)).strip()
         else:
-            response = httpx.post(
-                f"{OPENAI_API_BASE}/completions",
-                json=payload,
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            reply = response.json()["choices"][0]["text"].strip()
+            reply = llm_client.complete(payload, timeout=TIMEOUT)
 
         end_time = time.time()
         print(f"LLM request completed in {end_time - start_time:.2f} seconds")
 
         memory_state.conversation_memory.append({"role": "assistant", "content": reply})
-        memory_state.extract_and_save_memories(user_message, reply)
+        post_response.submit(memory_state.extract_and_save_memories, user_message, reply)
 
         return {"reply": reply}
 
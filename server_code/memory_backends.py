@@ -0,0 +1,741 @@
+# memory_backends.py
+import base64
+import datetime
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+
+from .memory_store import MemoryStore, ColumnarMemoryStore, MEMORY_COLUMNS, new_local_store
+from .keyword_index import tokenize
+from .memory_decay import as_utc
+
+try:
+    import anvil.tables as tables
+    import anvil.tables.query as q
+    from anvil.tables import app_tables
+    HAS_TABLES = True
+except ImportError:
+    HAS_TABLES = False
+
+DEFAULT_SQLITE_PATH = os.environ.get("NYX_MEMORY_DB", "nyx_memories.db")
+
+# Columns query() can order by
+ORDERABLE_COLUMNS = ("updated_at", "created_at", "importance")
+
+# Append-only logs kept next to the memories (a table of the same name in
+# Anvil tables and SQLite), with their columns
+LOG_COLUMNS = {
+    "thoughts": ("created_at", "thought", "context"),
+    "extraction_queue": ("created_at", "user_message", "assistant_response"),
+}
+
+# Importance never grows past this when memories are reinforced
+MAX_IMPORTANCE = 10
+DEFAULT_IMPORTANCE = 5
+
+
+def encode_cursor(record, order_by):
+    """Opaque page cursor: the sort position (order value, memory_type, key) of a record"""
+    value = record[order_by]
+    if isinstance(value, datetime.datetime):
+        value = {"dt": value.isoformat()}
+    position = [value, record["memory_type"], record["key"]]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    value, memory_type, key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if isinstance(value, dict):
+        value = datetime.datetime.fromisoformat(value["dt"])
+    return value, memory_type, key
+
+
+def _boosted(importance, amount):
+    base = DEFAULT_IMPORTANCE if importance is None else importance
+    return min(MAX_IMPORTANCE, base + amount)
+
+
+def _sort_position(record, order_by):
+    return record[order_by], record["memory_type"], record["key"]
+
+
+def _matches(record, memory_type=None, min_importance=None, updated_since=None,
+             include_expired=True, exclude_types=()):
+    """Filter shared by backends that evaluate queries in Python"""
+    if memory_type and record["memory_type"] != memory_type:
+        return False
+    if record["memory_type"] in exclude_types:
+        return False
+    if not include_expired and record["is_expired"]:
+        return False
+    if min_importance is not None and (record["importance"] is None or record["importance"] < min_importance):
+        return False
+    if updated_since is not None and (record["updated_at"] is None or record["updated_at"] < updated_since):
+        return False
+    return True
+
+
+class MemoryBackend:
+    """
+    Storage interface used by memory_state.
+
+    Records are dicts with the columns of the `memories` table
+    (MEMORY_COLUMNS). Backends that can answer keyword queries themselves
+    return results from keyword_search(); the others return None and the
+    in-process BM25 index is used instead.
+    """
+
+    name = "base"
+    # Whether save_memory should defer writes to the request's unit of work
+    defer_writes = True
+
+    def get(self, memory_type, key):
+        """Return one record or None"""
+        raise NotImplementedError
+
+    def search(self, memory_type=None, include_expired=True):
+        """Return all records, optionally of one type and/or leaving out expired ones"""
+        raise NotImplementedError
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation"):
+        """
+        Update the value of a memory (reviving it if it had expired) or
+        create it. Returns (record, created).
+        """
+        raise NotImplementedError
+
+    def write_batch(self, writes):
+        """
+        Apply coalesced writes ({(memory_type, key): record}) together.
+        Existing memories only take the new value and updated_at (and are
+        no longer expired).
+        """
+        for write in writes.values():
+            self.upsert(write["memory_type"], write["key"], write["value"],
+                        write["importance"], write["source"])
+
+    def update(self, memory_type, key, **fields):
+        """Set columns (e.g. importance, is_expired) on an existing memory"""
+        raise NotImplementedError
+
+    def reinforce(self, boosts, now=None):
+        """
+        Raise the importance of existing memories ({(memory_type, key): amount},
+        capped at MAX_IMPORTANCE) and mark them as updated now.
+        """
+        now = now or datetime.datetime.now()
+        for (memory_type, key), amount in boosts.items():
+            record = self.get(memory_type, key)
+            if record is not None:
+                self.update(memory_type, key, updated_at=now,
+                            importance=_boosted(record["importance"], amount))
+
+    def invalidate(self, memory_type, key):
+        """Forget any cached copy of a memory that was changed behind our back"""
+
+    def invalidate_all(self):
+        """Forget every cached row (another process changed storage)"""
+
+    def keyword_search(self, query, limit=5, exclude_types=()):
+        """Return [(score, (memory_type, key))] best first, or None if unsupported"""
+        return None
+
+    def count(self):
+        return len(self.search())
+
+    # Logs (see LOG_COLUMNS). Entries are dicts of the log's columns; the ones
+    # read back also carry an "id" that log_delete accepts.
+
+    def log_append(self, log, entries):
+        raise NotImplementedError
+
+    def log_count(self, log):
+        raise NotImplementedError
+
+    def log_read(self, log, limit, newest=False):
+        """The oldest (or newest) `limit` entries of a log, oldest first"""
+        raise NotImplementedError
+
+    def log_delete(self, log, entries):
+        raise NotImplementedError
+
+    def log_take(self, log, limit):
+        """
+        Remove and return the oldest `limit` entries, as one atomic step
+        where the storage allows it, so concurrent takers never share an entry
+        """
+        entries = self.log_read(log, limit)
+        if entries:
+            self.log_delete(log, entries)
+        return entries
+
+    def log_trim(self, log, cutoff, keep, limit):
+        """
+        Delete up to `limit` of the oldest entries that are older than
+        `cutoff` or beyond the newest `keep`. Returns the number deleted.
+        """
+        excess = max(0, self.log_count(log) - keep)
+        stale = []
+        for entry in self.log_read(log, limit):
+            if len(stale) >= excess and entry["created_at"] is not None and as_utc(entry["created_at"]) >= cutoff:
+                break
+            stale.append(entry)
+        if stale:
+            self.log_delete(log, stale)
+        return len(stale)
+
+    def query(self, order_by="updated_at", descending=True, limit=10, after=None, **filters):
+        """
+        Return up to `limit` records sorted by (order_by, memory_type, key),
+        starting after the sort position `after` (see decode_cursor).
+
+        Filters: memory_type, min_importance, updated_since, include_expired,
+        exclude_types. Records with no value in the order column are skipped.
+
+        This default keeps a bounded heap of `limit` records while scanning,
+        for backends that cannot sort themselves.
+        """
+        def beyond_cursor(position):
+            if after is None:
+                return True
+            return position < after if descending else position > after
+
+        candidates = (
+            record for record in self.search(filters.get("memory_type"), filters.get("include_expired", True))
+            if record[order_by] is not None and _matches(record, **filters)
+            and beyond_cursor(_sort_position(record, order_by))
+        )
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return select(limit, candidates, key=lambda record: _sort_position(record, order_by))
+
+
+class LocalBackend(MemoryBackend):
+    """Process-local storage in a MemoryStore or ColumnarMemoryStore (lost on restart)"""
+
+    name = "local"
+    defer_writes = False
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else new_local_store()
+        self.logs = {log: [] for log in LOG_COLUMNS}  # Entries in created_at order
+        self._log_lock = threading.Lock()
+        self._log_ids = itertools.count(1)
+
+    def get(self, memory_type, key):
+        return self.store.get(memory_type, key)
+
+    def search(self, memory_type=None, include_expired=True):
+        return self.store.select(memory_type, include_expired)
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation"):
+        return self.store.upsert(memory_type, key, value, importance, source)
+
+    def update(self, memory_type, key, **fields):
+        return self.store.update(memory_type, key, **fields)
+
+    def count(self):
+        return len(self.store)
+
+    def log_append(self, log, entries):
+        with self._log_lock:
+            for entry in entries:
+                self.logs[log].append(dict({column: entry.get(column) for column in LOG_COLUMNS[log]},
+                                           id=next(self._log_ids)))
+            self.logs[log].sort(key=lambda entry: as_utc(entry["created_at"]))
+
+    def log_count(self, log):
+        return len(self.logs[log])
+
+    def log_read(self, log, limit, newest=False):
+        with self._log_lock:
+            entries = self.logs[log][-limit:] if newest else self.logs[log][:limit]
+            return [dict(entry) for entry in entries]
+
+    def log_delete(self, log, entries):
+        ids = {entry["id"] for entry in entries}
+        with self._log_lock:
+            self.logs[log] = [entry for entry in self.logs[log] if entry["id"] not in ids]
+
+    def log_take(self, log, limit):
+        with self._log_lock:
+            taken, self.logs[log] = self.logs[log][:limit], self.logs[log][limit:]
+            return taken
+
+    def query(self, order_by="updated_at", descending=True, limit=10, after=None, **filters):
+        if isinstance(self.store, ColumnarMemoryStore):
+            return self.store.query(order_by, descending, limit, after, **filters)
+        return super().query(order_by, descending, limit, after, **filters)
+
+
+class TablesBackend(MemoryBackend):
+    """
+    Anvil `memories` table with a read-through cache of rows.
+
+    Cached records keep a reference to their table row under "row", so
+    updates of memories we've already seen skip the lookup.
+    """
+
+    name = "tables"
+
+    def __init__(self):
+        self.cache = MemoryStore()
+
+    def _cache_row(self, row):
+        record = {column: row[column] for column in MEMORY_COLUMNS}
+        record["row"] = row
+        return self.cache.put(record)
+
+    def _row(self, memory_type, key):
+        cached = self.cache.get(memory_type, key)
+        if cached is not None:
+            return cached["row"]
+        row = app_tables.memories.get(memory_type=memory_type, key=key)
+        if row is not None:
+            self._cache_row(row)
+        return row
+
+    def get(self, memory_type, key):
+        if self._row(memory_type, key) is None:
+            return None
+        return self.cache.get(memory_type, key)
+
+    def search(self, memory_type=None, include_expired=True):
+        conditions = {}
+        if memory_type:
+            conditions["memory_type"] = memory_type
+        if not include_expired:
+            conditions["is_expired"] = q.not_equal_to(True)
+        return [self._cache_row(row) for row in app_tables.memories.search(**conditions)]
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation"):
+        now = datetime.datetime.now()
+        existing = self._row(memory_type, key)
+        if existing:
+            existing.update(value=value, updated_at=now, is_expired=False)
+            cached = self.cache.get(memory_type, key)
+            cached.update(value=value, updated_at=now, is_expired=False)
+            return cached, False
+
+        row = app_tables.memories.add_row(
+            memory_type=memory_type,
+            key=key,
+            value=value,
+            created_at=now,
+            updated_at=now,
+            importance=importance,
+            source=source,
+            is_expired=False
+        )
+        return self._cache_row(row), True
+
+    def _existing_rows(self, type_and_keys):
+        """Find table rows for many keys, using the cache and at most one search"""
+        rows = {}
+        uncached = []
+        for memory_type, key in type_and_keys:
+            cached = self.cache.get(memory_type, key)
+            if cached is not None:
+                rows[(memory_type, key)] = cached["row"]
+            else:
+                uncached.append((memory_type, key))
+
+        if uncached:
+            wanted = set(uncached)
+            matches = app_tables.memories.search(
+                memory_type=q.any_of(*{memory_type for memory_type, _ in uncached}),
+                key=q.any_of(*{key for _, key in uncached})
+            )
+            for row in matches:
+                if (row["memory_type"], row["key"]) in wanted:
+                    rows[(row["memory_type"], row["key"])] = row
+                    self._cache_row(row)
+        return rows
+
+    def write_batch(self, writes):
+        """One search for unknown rows, one batched update and one add_rows call"""
+        existing = self._existing_rows(writes.keys())
+        new_rows = []
+        with tables.batch_update:
+            for type_and_key, write in writes.items():
+                row = existing.get(type_and_key)
+                if row is None:
+                    new_rows.append({column: write[column] for column in MEMORY_COLUMNS})
+                    continue
+                fields = {"value": write["value"], "updated_at": write["updated_at"], "is_expired": False}
+                row.update(**fields)
+                self.cache.get(*type_and_key).update(fields)
+
+        if new_rows:
+            for row in app_tables.memories.add_rows(new_rows):
+                self._cache_row(row)
+
+    def update(self, memory_type, key, **fields):
+        row = self._row(memory_type, key)
+        if row is None:
+            return None
+        row.update(**fields)
+        cached = self.cache.get(memory_type, key)
+        cached.update(fields)
+        return cached
+
+    def reinforce(self, boosts, now=None):
+        """One search for unknown rows and one batched update"""
+        now = now or datetime.datetime.now()
+        existing = self._existing_rows(boosts.keys())
+        with tables.batch_update:
+            for type_and_key, row in existing.items():
+                fields = {"importance": _boosted(row["importance"], boosts[type_and_key]), "updated_at": now}
+                row.update(**fields)
+                self.cache.get(*type_and_key).update(fields)
+
+    def invalidate(self, memory_type, key):
+        self.cache.remove(memory_type, key)
+
+    def invalidate_all(self):
+        self.cache.clear()
+
+    @staticmethod
+    def _log_entry(log, row):
+        return dict({column: row[column] for column in LOG_COLUMNS[log]}, id=row)
+
+    def log_append(self, log, entries):
+        getattr(app_tables, log).add_rows([{column: entry.get(column) for column in LOG_COLUMNS[log]}
+                                           for entry in entries])
+
+    def log_count(self, log):
+        return len(getattr(app_tables, log).search())
+
+    def log_read(self, log, limit, newest=False):
+        rows = getattr(app_tables, log).search(tables.order_by("created_at", ascending=not newest))
+        entries = [self._log_entry(log, row) for row in itertools.islice(rows, limit)]
+        return entries[::-1] if newest else entries
+
+    def log_delete(self, log, entries):
+        with tables.batch_delete:
+            for entry in entries:
+                entry["id"].delete()
+
+    def log_take(self, log, limit):
+        # In a transaction, so two processes can never both take the same rows
+        @tables.in_transaction
+        def take():
+            entries = self.log_read(log, limit)
+            for entry in entries:
+                entry["id"].delete()
+            return entries
+        return take()
+
+    def query(self, order_by="updated_at", descending=True, limit=10, after=None, memory_type=None,
+              min_importance=None, updated_since=None, include_expired=True, exclude_types=()):
+        """
+        Sorted, filtered search that stops after `limit` rows: the table
+        sorts and pages its results, so only the rows we consume are fetched.
+        """
+        conditions = {order_by: [q.not_equal_to(None)]}
+        if min_importance is not None:
+            conditions.setdefault("importance", []).append(q.greater_than_or_equal_to(min_importance))
+        if updated_since is not None:
+            conditions.setdefault("updated_at", []).append(q.greater_than_or_equal_to(updated_since))
+        if after is not None:
+            # Rows tied on the order value are skipped below
+            bound = q.less_than_or_equal_to if descending else q.greater_than_or_equal_to
+            conditions[order_by].append(bound(after[0]))
+
+        kwargs = {column: found[0] if len(found) == 1 else q.all_of(*found)
+                  for column, found in conditions.items()}
+        if memory_type:
+            kwargs["memory_type"] = memory_type
+        elif exclude_types:
+            kwargs["memory_type"] = q.none_of(*exclude_types)
+        if not include_expired:
+            kwargs["is_expired"] = q.not_equal_to(True)
+
+        rows = app_tables.memories.search(
+            tables.order_by(order_by, ascending=not descending),
+            tables.order_by("memory_type", ascending=not descending),
+            tables.order_by("key", ascending=not descending),
+            **kwargs
+        )
+        if after is not None:
+            rows = itertools.dropwhile(
+                lambda row: (_sort_position(row, order_by) >= after) if descending
+                else (_sort_position(row, order_by) <= after), rows)
+        return [self._cache_row(row) for row in itertools.islice(rows, limit)]
+
+
+class SQLiteBackend(MemoryBackend):
+    """
+    Persistent storage in a local SQLite database, for self-hosted
+    deployments without Anvil tables.
+
+    The database runs in WAL mode so readers never block the writer and
+    several server processes can share the file. (memory_type, key) is a
+    unique index, updated_at and importance are indexed for recency and
+    importance queries, and an FTS5 table kept in sync by triggers serves
+    keyword retrieval with SQLite's built-in bm25() ranking.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS memories (
+        id INTEGER PRIMARY KEY,
+        memory_type TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT,
+        created_at TEXT,
+        updated_at TEXT,
+        importance REAL,
+        source TEXT,
+        is_expired INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS memories_type_key ON memories (memory_type, key);
+    CREATE INDEX IF NOT EXISTS memories_updated_at ON memories (updated_at);
+    CREATE INDEX IF NOT EXISTS memories_importance ON memories (importance);
+    CREATE TABLE IF NOT EXISTS thoughts (
+        id INTEGER PRIMARY KEY,
+        created_at TEXT,
+        thought TEXT,
+        context TEXT
+    );
+    CREATE INDEX IF NOT EXISTS thoughts_created_at ON thoughts (created_at);
+    CREATE TABLE IF NOT EXISTS extraction_queue (
+        id INTEGER PRIMARY KEY,
+        created_at TEXT,
+        user_message TEXT,
+        assistant_response TEXT
+    );
+    CREATE INDEX IF NOT EXISTS extraction_queue_created_at ON extraction_queue (created_at);
+    """
+
+    FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+        USING fts5(key, value, content='memories', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+    END;
+    CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+        INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+    END;
+    CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF key, value ON memories BEGIN
+        INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+        INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+    END;
+    """
+
+    COLUMNS = ", ".join(MEMORY_COLUMNS)
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.has_fts = False
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        try:
+            conn.executescript(self.FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            print(f"SQLite FTS5 unavailable ({e}), using in-process keyword index")
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_record(row):
+        record = dict(zip(MEMORY_COLUMNS, row))
+        for column in ("created_at", "updated_at"):
+            if record[column]:
+                record[column] = datetime.datetime.fromisoformat(record[column])
+        record["is_expired"] = bool(record["is_expired"])
+        return record
+
+    @staticmethod
+    def _timestamp(value):
+        return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+    def get(self, memory_type, key):
+        row = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM memories WHERE memory_type = ? AND key = ?",
+            (memory_type, key)).fetchone()
+        return row and self._to_record(row)
+
+    def search(self, memory_type=None, include_expired=True):
+        clauses, params = [], []
+        if memory_type:
+            clauses.append("memory_type = ?")
+            params.append(memory_type)
+        if not include_expired:
+            clauses.append("is_expired = 0")
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(f"SELECT {self.COLUMNS} FROM memories{where} ORDER BY id", params)
+        return [self._to_record(row) for row in rows]
+
+    UPSERT = """
+    INSERT INTO memories (memory_type, key, value, created_at, updated_at, importance, source, is_expired)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+    ON CONFLICT (memory_type, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at,
+        is_expired = 0
+    """
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation"):
+        now = datetime.datetime.now().isoformat()
+        conn = self._conn()
+        # One write transaction, so no other process can create the row between the check and the insert
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            created = conn.execute("SELECT 1 FROM memories WHERE memory_type = ? AND key = ?",
+                                   (memory_type, key)).fetchone() is None
+            conn.execute(self.UPSERT, (memory_type, key, value, now, now, importance, source))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(memory_type, key), created
+
+    def write_batch(self, writes):
+        """All writes in a single transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(self.UPSERT, [
+                (w["memory_type"], w["key"], w["value"], self._timestamp(w["created_at"]),
+                 self._timestamp(w["updated_at"]), w["importance"], w["source"])
+                for w in writes.values()
+            ])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update(self, memory_type, key, **fields):
+        fields = {column: value for column, value in fields.items() if column in MEMORY_COLUMNS}
+        if not fields:
+            return self.get(memory_type, key)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        values = [self._timestamp(value) for value in fields.values()]
+        self._conn().execute(f"UPDATE memories SET {assignments} WHERE memory_type = ? AND key = ?",
+                             values + [memory_type, key])
+        return self.get(memory_type, key)
+
+    def reinforce(self, boosts, now=None):
+        """All boosts in a single transaction"""
+        now = self._timestamp(now or datetime.datetime.now())
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE memories SET importance = MIN(?, COALESCE(importance, ?) + ?), updated_at = ? "
+                "WHERE memory_type = ? AND key = ?",
+                [(MAX_IMPORTANCE, DEFAULT_IMPORTANCE, amount, now, memory_type, key)
+                 for (memory_type, key), amount in boosts.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _log_entry(self, log, row):
+        entry = dict(zip(("id",) + LOG_COLUMNS[log], row))
+        if entry["created_at"]:
+            entry["created_at"] = datetime.datetime.fromisoformat(entry["created_at"])
+        return entry
+
+    def log_append(self, log, entries):
+        columns = LOG_COLUMNS[log]
+        self._conn().executemany(
+            f"INSERT INTO {log} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+            [[self._timestamp(entry.get(column)) for column in columns] for entry in entries])
+
+    def log_count(self, log):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {log}").fetchone()[0]
+
+    def log_read(self, log, limit, newest=False):
+        order = "DESC" if newest else "ASC"
+        rows = self._conn().execute(
+            f"SELECT id, {', '.join(LOG_COLUMNS[log])} FROM {log} ORDER BY created_at {order}, id {order} LIMIT ?",
+            (limit,))
+        entries = [self._log_entry(log, row) for row in rows]
+        return entries[::-1] if newest else entries
+
+    def log_delete(self, log, entries):
+        self._conn().executemany(f"DELETE FROM {log} WHERE id = ?", [(entry["id"],) for entry in entries])
+
+    def log_take(self, log, limit):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # Holds the write lock, so no other process takes the same rows
+        try:
+            entries = self.log_read(log, limit)
+            self.log_delete(log, entries)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return entries
+
+    def keyword_search(self, query, limit=5, exclude_types=()):
+        if not self.has_fts:
+            return None
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        exclude = "".join(" AND m.memory_type != ?" for _ in exclude_types)
+        rows = self._conn().execute(
+            f"""
+            SELECT m.memory_type, m.key, bm25(memories_fts) AS rank
+            FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid
+            WHERE memories_fts MATCH ? AND m.is_expired = 0{exclude}
+            ORDER BY rank LIMIT ?
+            """, (match, *exclude_types, limit))
+        # bm25() is lower-is-better; flip it so higher scores are better everywhere
+        return [(-rank, (memory_type, key)) for memory_type, key, rank in rows]
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+    def query(self, order_by="updated_at", descending=True, limit=10, after=None, memory_type=None,
+              min_importance=None, updated_since=None, include_expired=True, exclude_types=()):
+        """Keyset-paginated ORDER BY ... LIMIT served from the column indexes"""
+        if order_by not in ORDERABLE_COLUMNS:
+            raise ValueError(f"Cannot order memories by {order_by}")
+
+        clauses = [f"{order_by} IS NOT NULL"]
+        params = []
+        if memory_type:
+            clauses.append("memory_type = ?")
+            params.append(memory_type)
+        for excluded in exclude_types:
+            clauses.append("memory_type != ?")
+            params.append(excluded)
+        if min_importance is not None:
+            clauses.append("importance >= ?")
+            params.append(min_importance)
+        if updated_since is not None:
+            clauses.append("updated_at >= ?")
+            params.append(self._timestamp(updated_since))
+        if not include_expired:
+            clauses.append("is_expired = 0")
+        if after is not None:
+            clauses.append(f"({order_by}, memory_type, key) {'<' if descending else '>'} (?, ?, ?)")
+            params.extend([self._timestamp(after[0]), after[1], after[2]])
+
+        direction = "DESC" if descending else "ASC"
+        rows = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM memories WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {order_by} {direction}, memory_type {direction}, key {direction} LIMIT ?",
+            params + [limit])
+        return [self._to_record(row) for row in rows]
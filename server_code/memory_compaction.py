@@ -0,0 +1,187 @@
+# memory_compaction.py
+import datetime
+import json
+import re
+import anvil.server
+
+from . import memory_state
+from . import llm_integration
+from . import llm_client
+from .memory_backends import encode_cursor, decode_cursor, _sort_position
+from .memory_decay import as_utc, utc_now
+
+# Interaction and thought rows older than this are folded into summaries
+COMPACTION_AGE_DAYS = 7
+# Only rows at or below this stored importance are compacted (thoughts are saved at 7)
+COMPACTION_MAX_IMPORTANCE = 7
+COMPACTION_KEY_PREFIXES = ("interaction_", "thought_")
+COMPACTION_BATCH_ROWS = 200  # Rows folded per compaction step
+COMPACTION_PAGE_SIZE = 100
+
+# Summaries are written per day as interaction memories
+SUMMARY_KEY_PREFIX = "summary_"
+SUMMARY_IMPORTANCE = 6
+SUMMARY_SAMPLE_LINES = 5  # Lines quoted in an extractive summary
+SUMMARY_LINE_CHARS = 120
+SUMMARY_MAX_CHARS = 1000  # A period compacted over many steps never grows past this
+
+# Ask the model for the summaries (one call per compaction step for all
+# periods); otherwise an extractive summary is built locally
+USE_LLM_SUMMARIES = False
+
+
+def _period(record):
+    return as_utc(record["created_at"]).date().isoformat()
+
+
+def _compactable(record):
+    return (record["key"].startswith(COMPACTION_KEY_PREFIXES)
+            and (record["importance"] or 0) <= COMPACTION_MAX_IMPORTANCE)
+
+
+_EXTRACTIVE_SUMMARY = re.compile(r"On (\S+): (\d+) interactions and (\d+) thoughts\. Latest: (.*)", re.S)
+
+
+def _format_summary(period, interactions, thoughts, lines):
+    return f"On {period}: {interactions} interactions and {thoughts} thoughts. Latest: " + " | ".join(lines)
+
+
+def _extractive_summary(period, records):
+    thoughts = [r for r in records if r["key"].startswith("thought_")]
+    lines = [r["value"][:SUMMARY_LINE_CHARS] for r in records[-SUMMARY_SAMPLE_LINES:]]
+    return _format_summary(period, len(records) - len(thoughts), len(thoughts), lines)
+
+
+def _merge_summaries(period, existing, summary):
+    """
+    One summary for a period compacted over several steps. Extractive
+    summaries are regenerated with the counts added up and the newest
+    lines; anything else is joined and trimmed to the newest SUMMARY_MAX_CHARS.
+    """
+    old, new = _EXTRACTIVE_SUMMARY.fullmatch(existing), _EXTRACTIVE_SUMMARY.fullmatch(summary)
+    if old and new:
+        lines = (old.group(4).split(" | ") + new.group(4).split(" | "))[-SUMMARY_SAMPLE_LINES:]
+        summary = _format_summary(period, int(old.group(2)) + int(new.group(2)),
+                                  int(old.group(3)) + int(new.group(3)), lines)
+    else:
+        summary = f"{existing} {summary}"
+    if len(summary) > SUMMARY_MAX_CHARS:
+        summary = "..." + summary[-(SUMMARY_MAX_CHARS - 3):]
+    return summary
+
+
+def _llm_summaries(groups):
+    """Summarise every period in one completion call. Returns {period: summary}."""
+    sections = []
+    for period, records in groups.items():
+        lines = "\n".join(f"- {r['value'][:SUMMARY_LINE_CHARS]}" for r in records)
+        sections.append(f"PERIOD {period}:\n{lines}")
+
+    prompt = f"""
+    Summarise what happened in each period of the conversation log below in one or two sentences,
+    keeping anything that matters for continuity (topics, the user's state, recurring thoughts).
+
+    {chr(10).join(sections)}
+
+    Respond with a JSON object mapping each period to its summary:
+    {{"summaries": {{"<period>": "<summary>"}}}}
+    """
+
+    text = llm_client.complete(
+        {
+            "model": llm_integration.OPENAI_MODEL,
+            "prompt": prompt,
+            "max_tokens": 128 * len(groups),
+            "temperature": 0.2,
+            "response_format": {"type": "json_object"}
+        },
+        timeout=llm_integration.TIMEOUT
+    )
+    return json.loads(text).get("summaries", {})
+
+
+def _summarise(groups):
+    summaries = {}
+    if USE_LLM_SUMMARIES:
+        try:
+            summaries = _llm_summaries(groups)
+        except Exception as e:
+            print(f"LLM compaction summary failed ({e}), using extractive summaries")
+    return {period: summaries.get(period) or _extractive_summary(period, records)
+            for period, records in groups.items()}
+
+
+def _write_summaries(groups, summaries):
+    interaction_type = memory_state.MEMORY_TYPES["INTERACTION"]
+    for period, summary in summaries.items():
+        key = f"{SUMMARY_KEY_PREFIX}{period}"
+        # Rows of a period can be compacted in more than one step
+        existing = memory_state.get_memory(interaction_type, key)
+        if existing:
+            summary = _merge_summaries(period, existing["value"], summary)
+        memory_state.save_memory(interaction_type, key, summary, importance=SUMMARY_IMPORTANCE,
+                                 source="compaction", merge_duplicates=False)
+        for record in groups[period]:
+            memory_state.expire_memory(record["memory_type"], record["key"])
+
+
+def compact_memories(cursor=None, max_rows=COMPACTION_BATCH_ROWS, now=None):
+    """
+    One compaction step: collect up to `max_rows` compactable rows (oldest
+    first, starting after `cursor`), fold them into per-day summaries and
+    expire them.
+
+    Returns {"compacted", "summaries", "next_cursor"}; next_cursor is None
+    once every row older than COMPACTION_AGE_DAYS has been visited.
+    """
+    now = as_utc(now or utc_now())
+    # Whole days (UTC) only, so a period is never summarised while still receiving rows
+    cutoff = datetime.datetime.combine((now - datetime.timedelta(days=COMPACTION_AGE_DAYS)).date(),
+                                       datetime.time.min, tzinfo=datetime.timezone.utc)
+
+    groups = {}
+    compacted = 0
+    after = decode_cursor(cursor)
+    next_cursor = None
+    while compacted < max_rows:
+        records = memory_state.backend.query(
+            order_by="created_at", descending=False, limit=COMPACTION_PAGE_SIZE, after=after,
+            memory_type=memory_state.MEMORY_TYPES["INTERACTION"], include_expired=False
+        )
+        reached_cutoff = False
+        for record in records:
+            if as_utc(record["created_at"]) >= cutoff:
+                reached_cutoff = True
+                break
+            if _compactable(record):
+                groups.setdefault(_period(record), []).append(record)
+                compacted += 1
+            after = _sort_position(record, "created_at")
+            next_cursor = encode_cursor(record, "created_at")
+            if compacted >= max_rows:
+                break
+        if compacted >= max_rows:
+            break  # The next step resumes after the last row compacted here
+        if reached_cutoff or len(records) < COMPACTION_PAGE_SIZE:
+            next_cursor = None
+            break
+
+    if groups:
+        _write_summaries(groups, _summarise(groups))
+        print(f"Compacted {compacted} memories into {len(groups)} period summaries")
+    return {"compacted": compacted, "summaries": len(groups), "next_cursor": next_cursor}
+
+
+@anvil.server.callable
+def compact_old_memories():
+    """Run compaction over every eligible memory"""
+    totals = {"compacted": 0, "summaries": 0}
+    cursor = None
+    while True:
+        result = compact_memories(cursor)
+        totals["compacted"] += result["compacted"]
+        totals["summaries"] += result["summaries"]
+        cursor = result["next_cursor"]
+        if not cursor:
+            break
+    return totals
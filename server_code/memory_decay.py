@@ -0,0 +1,62 @@
+# memory_decay.py
+import datetime
+
+from .vector_index import HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# Memories keep their full importance for this long after their last update
+DECAY_GRACE_DAYS = 30
+# After the grace period importance halves every DECAY_HALF_LIFE_DAYS
+DECAY_HALF_LIFE_DAYS = 30
+# Memories whose effective importance falls below this are expired
+EXPIRY_THRESHOLD = 4
+DEFAULT_IMPORTANCE = 5
+
+
+def as_utc(moment):
+    """
+    `moment` as a timezone-aware UTC datetime. Anvil tables return aware
+    datetimes while the local backends keep naive (server local time) ones,
+    so both sides of a comparison go through here.
+    """
+    return None if moment is None else moment.astimezone(datetime.timezone.utc)
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _age_days(updated_at, now):
+    if updated_at is None:
+        return 0.0
+    return (as_utc(now) - as_utc(updated_at)).total_seconds() / 86400.0
+
+
+def effective_importance(base_importance, updated_at, now=None):
+    """
+    Importance of a memory right now, computed from its stored (base)
+    importance and the time since it was last updated:
+
+        base * 0.5 ** (max(0, age_days - DECAY_GRACE_DAYS) / DECAY_HALF_LIFE_DAYS)
+
+    Nothing is written back; decay is a pure function of time.
+    """
+    now = now or utc_now()
+    base = DEFAULT_IMPORTANCE if base_importance is None else base_importance
+    overdue = max(0.0, _age_days(updated_at, now) - DECAY_GRACE_DAYS)
+    return base * 0.5 ** (overdue / DECAY_HALF_LIFE_DAYS)
+
+
+def effective_importances(base_importances, updated_ats, now=None):
+    """effective_importance for many memories at once (vectorized when numpy is available)"""
+    now = now or utc_now()
+    if not HAS_NUMPY:
+        return [effective_importance(base, updated_at, now)
+                for base, updated_at in zip(base_importances, updated_ats)]
+
+    base = np.array([DEFAULT_IMPORTANCE if b is None else b for b in base_importances], dtype=np.float64)
+    ages = np.array([_age_days(updated_at, now) for updated_at in updated_ats], dtype=np.float64)
+    return base * np.exp2(-np.maximum(0.0, ages - DECAY_GRACE_DAYS) / DECAY_HALF_LIFE_DAYS)
+
@@ -0,0 +1,195 @@
+# memory_maintenance.py
+import datetime
+import json
+import time
+import anvil.server
+
+from . import memory_state
+from . import advanced_memory
+from . import memory_compaction
+from . import thought_log
+from .memory_backends import encode_cursor, decode_cursor, _sort_position
+from .memory_decay import effective_importances, as_utc, utc_now, EXPIRY_THRESHOLD, DECAY_GRACE_DAYS
+
+# Work done per run of the scheduled task. A run stops as soon as it has
+# used its time budget; the next run resumes from the saved cursor.
+MAINTENANCE_TIME_BUDGET = 2.0  # Seconds
+MAINTENANCE_BATCH_SIZE = 100  # Rows read per storage query
+
+# Passes run in this order, then maintenance starts over
+MAINTENANCE_PHASES = ("compaction", "expiry", "caps", "thoughts")
+
+# Progress is kept in a "state" memory so it survives between runs
+MAINTENANCE_STATE_KEY = "maintenance"
+
+
+def _new_job(last_pass=None):
+    return {
+        "phase": MAINTENANCE_PHASES[0],
+        "cursor": None,  # encode_cursor position of the last row handled in this phase
+        "type_counts": {},  # caps phase: live memories seen so far per type
+        "started_at": datetime.datetime.now().isoformat(),
+        "totals": {"scanned": 0, "compacted": 0, "expired": 0, "capped": 0, "thoughts_deleted": 0},
+        "last_pass": last_pass,  # totals of the previous complete pass
+    }
+
+
+def _load_job():
+    saved = memory_state.get_memory(memory_state.MEMORY_TYPES["STATE"], MAINTENANCE_STATE_KEY)
+    if saved:
+        try:
+            job = json.loads(saved["value"])
+            if job.get("phase") in MAINTENANCE_PHASES:
+                return job
+        except ValueError:
+            print("Ignoring unreadable maintenance state")
+    return _new_job()
+
+
+def _save_job(job):
+    memory_state.save_memory(memory_state.MEMORY_TYPES["STATE"], MAINTENANCE_STATE_KEY, json.dumps(job),
+                             importance=1, source="maintenance")
+
+
+def _pages(job, deadline, order_by, descending, **filters):
+    """
+    Yield pages of stored records after the job's cursor until storage is
+    exhausted (sets job["phase_done"]) or the deadline passes.
+    """
+    after = decode_cursor(job["cursor"])
+    while time.time() < deadline:
+        records = memory_state.backend.query(
+            order_by=order_by, descending=descending, limit=MAINTENANCE_BATCH_SIZE, after=after,
+            include_expired=False, exclude_types=(memory_state.MEMORY_TYPES["STATE"],), **filters
+        )
+        if records:
+            yield records
+        if len(records) < MAINTENANCE_BATCH_SIZE:
+            job["phase_done"] = True
+            return
+        after = _sort_position(records[-1], order_by)
+
+
+def _compaction_pass(job, deadline, stats):
+    """Fold old interaction/thought rows into period summaries (see memory_compaction)"""
+    while time.time() < deadline:
+        result = memory_compaction.compact_memories(job["cursor"])
+        stats["compacted"] += result["compacted"]
+        job["cursor"] = result["next_cursor"]
+        if not job["cursor"]:
+            job["phase_done"] = True
+            return
+
+
+def _expiry_pass(job, deadline, stats):
+    """Expire memories whose decayed importance fell below EXPIRY_THRESHOLD (oldest first)"""
+    cutoff = utc_now() - datetime.timedelta(days=DECAY_GRACE_DAYS)
+    for records in _pages(job, deadline, "updated_at", descending=False):
+        scores = effective_importances([r["importance"] for r in records], [r["updated_at"] for r in records])
+        for record, score in zip(records, scores):
+            if as_utc(record["updated_at"]) >= cutoff:
+                # Everything from here on is still inside the grace period
+                job["phase_done"] = True
+                return
+            if time.time() >= deadline:
+                return
+            if score < EXPIRY_THRESHOLD:
+                memory_state.expire_memory(record["memory_type"], record["key"])
+                stats["expired"] += 1
+            stats["scanned"] += 1
+            job["cursor"] = encode_cursor(record, "updated_at")
+
+
+def _caps_pass(job, deadline, stats):
+    """Keep only the MAX_MEMORIES_PER_TYPE most important live memories of each type"""
+    limit = advanced_memory.MAX_MEMORIES_PER_TYPE
+    counts = job["type_counts"]
+    for records in _pages(job, deadline, "importance", descending=True):
+        for record in records:
+            if time.time() >= deadline:
+                return
+            memory_type = record["memory_type"]
+            counts[memory_type] = counts.get(memory_type, 0) + 1
+            if counts[memory_type] > limit:
+                memory_state.expire_memory(memory_type, record["key"])
+                stats["capped"] += 1
+            stats["scanned"] += 1
+            job["cursor"] = encode_cursor(record, "importance")
+
+
+def _thoughts_pass(job, deadline, stats):
+    """Apply the thought log's retention limits"""
+    deleted, finished = thought_log.enforce_retention(deadline)
+    stats["thoughts_deleted"] += deleted
+    job["phase_done"] = finished
+
+
+PHASE_PASSES = {
+    "compaction": _compaction_pass,
+    "expiry": _expiry_pass,
+    "caps": _caps_pass,
+    "thoughts": _thoughts_pass,
+}
+
+
+def run_maintenance(time_budget=MAINTENANCE_TIME_BUDGET):
+    """
+    Do up to `time_budget` seconds of maintenance, resuming where the last
+    run stopped. Returns a report of the work done in this run.
+    """
+    start = time.time()
+    deadline = start + time_budget
+    job = _load_job()
+    stats = {"scanned": 0, "compacted": 0, "expired": 0, "capped": 0, "thoughts_deleted": 0}
+    phases_completed = []
+
+    while time.time() < deadline:
+        phase = job["phase"]
+        job["phase_done"] = False
+        before = dict(stats)
+        PHASE_PASSES[phase](job, deadline, stats)
+        for name in stats:
+            job["totals"][name] = job["totals"].get(name, 0) + stats[name] - before[name]
+        if not job.pop("phase_done"):
+            break
+
+        phases_completed.append(phase)
+        following = MAINTENANCE_PHASES.index(phase) + 1
+        if following == len(MAINTENANCE_PHASES):
+            print(f"Memory maintenance pass complete: {job['totals']}")
+            job = _new_job(last_pass=dict(job["totals"], started_at=job["started_at"],
+                                          finished_at=datetime.datetime.now().isoformat()))
+            break
+        job["phase"] = MAINTENANCE_PHASES[following]
+        job["cursor"] = None
+
+    _save_job(job)
+    if stats["compacted"] or stats["expired"] or stats["capped"]:
+        # Serving processes still hold the changed rows in their caches and indexes
+        memory_state.bump_storage_version()
+
+    report = dict(stats, phase=job["phase"], phases_completed=phases_completed,
+                  elapsed=round(time.time() - start, 3))
+    print(f"Memory maintenance: {report}")
+    return report
+
+
+@anvil.server.background_task
+def memory_maintenance_task():
+    """Scheduled task (see anvil.yaml) running one time-boxed maintenance slice"""
+    return run_maintenance()
+
+
+@anvil.server.callable
+def start_memory_maintenance():
+    """Launch a maintenance slice now, outside the schedule"""
+    task = anvil.server.launch_background_task("memory_maintenance_task")
+    return {"status": "started", "task_id": task.get_id()}
+
+
+@anvil.server.callable
+def get_maintenance_status():
+    """Where maintenance currently is and what the running pass has done so far"""
+    job = _load_job()
+    return {"phase": job["phase"], "started_at": job["started_at"], "totals": job["totals"],
+            "last_pass": job.get("last_pass")}
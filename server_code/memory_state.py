@@ -1,26 +1,57 @@
 # memory_state.py
 import json
 import datetime
+import functools
+import threading
+import time
+import uuid
 import anvil.server
+from .memory_store import new_local_store
+from .memory_backends import (LocalBackend, TablesBackend, SQLiteBackend, HAS_TABLES, DEFAULT_SQLITE_PATH,
+                              ORDERABLE_COLUMNS, encode_cursor, decode_cursor)
+from .keyword_index import BM25Index
+from .vector_index import VectorIndex, HAS_NUMPY
+from .ann_index import IVFIndex
+from .minhash_index import MinHashIndex
+from . import keyword_matcher
+from .memory_tiers import HotTier
+from .query_cache import QueryCache
+
+# Storage backend: "tables" (Anvil data tables), "sqlite" (local database
+# file, for self-hosted deployments) or "local" (in-process, lost on restart)
+MEMORY_BACKEND = "tables"
+SQLITE_PATH = DEFAULT_SQLITE_PATH
 
 # For local testing, we'll default to using Anvil tables if available
 global USE_LOCAL_STORAGE
 USE_LOCAL_STORAGE = False
 
-try:
-    from anvil.tables import app_tables
-    HAS_TABLES = True
-    print("Anvil tables detected - using them for memory storage")
-except ImportError:
-    HAS_TABLES = False
-    USE_LOCAL_STORAGE = True
-    print("WARNING: Anvil tables not available, using local storage for memories")
+# Retrieval engine used by get_relevant_memories: "keyword" (BM25),
+# "vector" (exact embedding search) or "ann" (approximate, needs USE_ANN_INDEX)
+RELEVANCE_ENGINE = "keyword"
+USE_ANN_INDEX = False  # Maintain an IVF index for very large memory archives
+
+# Saving a new memory whose value nearly duplicates an existing memory of the
+# same type reinforces the existing one instead (see minhash_index)
+MERGE_NEAR_DUPLICATES = True
+DUPLICATE_IMPORTANCE_BOOST = 1
 
 # We'll use both in-memory and persistent storage
 conversation_memory = []
 
 # Local memory storage for testing without Anvil tables
-local_memory_storage = []
+local_memory_storage = new_local_store()
+
+if MEMORY_BACKEND == "sqlite":
+    backend = SQLiteBackend(SQLITE_PATH)
+    print(f"Using SQLite memory storage at {SQLITE_PATH}")
+elif MEMORY_BACKEND == "tables" and HAS_TABLES:
+    backend = TablesBackend()
+    print("Anvil tables detected - using them for memory storage")
+else:
+    backend = LocalBackend(local_memory_storage)
+    USE_LOCAL_STORAGE = True
+    print("WARNING: Anvil tables not available, using local storage for memories")
 
 # Define memory types
 MEMORY_TYPES = {
@@ -28,127 +59,549 @@ MEMORY_TYPES = {
     "EMOTIONAL": "emotional",  # Emotional responses/states
     "PREFERENCE": "preference",  # User preferences
     "INTERACTION": "interaction",  # Patterns in interactions
+    "STATE": "state",  # Materialized internal state (e.g. current mood), never retrieved as a memory
 }
 
+class BackendKeywordIndex:
+    """
+    Keyword index adapter for backends with their own full-text search
+    (e.g. SQLite FTS5). Storage keeps it in sync, so add/remove are no-ops.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __len__(self):
+        return self.storage.count()
+
+    def doc_ids(self, limit=None):
+        records = self.storage.query(order_by="created_at", descending=False, limit=limit or self.storage.count(),
+                                     include_expired=False, exclude_types=(MEMORY_TYPES["STATE"],))
+        return [(r["memory_type"], r["key"]) for r in records]
+
+    def add(self, doc_id, text):
+        pass
+
+    def add_many(self, items):
+        pass
+
+    def remove(self, doc_id):
+        return False
+
+    def search(self, query, limit=5):
+        return self.storage.keyword_search(query, limit, exclude_types=(MEMORY_TYPES["STATE"],))
+
+# Retrieval indexes kept in sync by save_memory. Each index exposes
+# add(doc_id, text) / add_many(items) / remove(doc_id) / search(query, limit),
+# where doc_id is the (memory_type, key) pair of the memory.
+memory_indexes = {
+    "keyword": BM25Index(),
+}
+
+# Names of indexes that have been backfilled from storage
+_built_indexes = set()
+
+# Near-duplicate detector over memory values, keyed like the retrieval indexes
+duplicate_index = MinHashIndex()
+
+# Hot tier: important and recently used memories held in RAM. Storage is
+# the cold tier, consulted when the hot tier cannot answer.
+hot_tier = HotTier()
+_hot_tier_warmed = False
+
+# Results of get_memory listings (all memories, or all of one type),
+# invalidated by every write made through this module
+query_cache = QueryCache()
+
+# Other processes (e.g. the maintenance task) change storage behind this
+# process's caches. They bump a version kept in a "state" memory; serving
+# processes check it at most every STORAGE_VERSION_CHECK_INTERVAL seconds
+# and drop their caches and in-process indexes when it has moved.
+STORAGE_VERSION_KEY = "storage_version"
+STORAGE_VERSION_CHECK_INTERVAL = 30
+_storage_version = None
+_storage_version_checked = 0.0
+
+# Bumped whenever the in-process caches are dropped, so modules holding their
+# own copies of stored state (e.g. mood_state) know to reload
+cache_generation = 0
+
+def _configure_keyword_index():
+    """Prefer the backend's own full-text search over the in-process BM25 index"""
+    if backend.keyword_search("", 1) is not None:
+        memory_indexes["keyword"] = BackendKeywordIndex(backend)
+        _built_indexes.add("keyword")
+    elif isinstance(memory_indexes["keyword"], BackendKeywordIndex):
+        memory_indexes["keyword"] = BM25Index()
+        _built_indexes.discard("keyword")
+
+_configure_keyword_index()
+
+if HAS_NUMPY:
+    memory_indexes["vector"] = VectorIndex()
+    if USE_ANN_INDEX:
+        memory_indexes["ann"] = IVFIndex()
+else:
+    print("WARNING: numpy not available, semantic (vector) memory search disabled")
+
+# Per-thread unit of work collecting table writes (see memory_batch)
+_batch_state = threading.local()
+
+def _to_memory_dict(record):
+    """Convert a stored record to the shape returned by get_memory"""
+    return {"type": record["memory_type"], "key": record["key"], "value": record["value"]}
+
+def _reset_caches():
+    """Forget everything held in RAM about storage; indexes are rebuilt on next use"""
+    global _hot_tier_warmed, cache_generation
+    cache_generation += 1
+    for name, index in memory_indexes.items():
+        if not isinstance(index, BackendKeywordIndex):
+            index.clear()
+            _built_indexes.discard(name)
+    duplicate_index.clear()
+    _built_indexes.discard("duplicates")
+    hot_tier.clear()
+    _hot_tier_warmed = False
+    query_cache.clear()
+
+def use_backend(new_backend):
+    """Switch memory storage (e.g. to SQLiteBackend) at runtime"""
+    global backend, USE_LOCAL_STORAGE, _storage_version
+    backend = new_backend
+    USE_LOCAL_STORAGE = isinstance(new_backend, LocalBackend)
+    _configure_keyword_index()
+    _reset_caches()
+    _storage_version = None
+    print(f"Memory storage switched to {backend.name}")
+
+def _read_storage_version():
+    backend.invalidate(MEMORY_TYPES["STATE"], STORAGE_VERSION_KEY)  # Always a fresh read
+    record = backend.get(MEMORY_TYPES["STATE"], STORAGE_VERSION_KEY)
+    return record["value"] if record else ""
+
+def check_storage_version():
+    """Drop this process's caches if another process has bumped the storage version"""
+    global _storage_version, _storage_version_checked
+    if time.time() - _storage_version_checked < STORAGE_VERSION_CHECK_INTERVAL:
+        return
+    _storage_version_checked = time.time()
+    try:
+        version = _read_storage_version()
+    except Exception as e:
+        print(f"Error checking storage version: {e}")
+        return
+    if _storage_version is not None and version != _storage_version:
+        print("Memory storage changed by another process - dropping cached memories")
+        _reset_caches()
+        backend.invalidate_all()
+    _storage_version = version
+
+def bump_storage_version():
+    """Tell other processes that rows were changed (e.g. expired) behind their caches"""
+    global _storage_version
+    _storage_version = uuid.uuid4().hex
+    backend.upsert(MEMORY_TYPES["STATE"], STORAGE_VERSION_KEY, _storage_version,
+                   importance=1, source="maintenance")
+
+def clear_local_memories():
+    """Empty the local memory store, along with everything indexed or cached from it"""
+    local_memory_storage.clear()
+    _reset_caches()
+
+def _fall_back_to_local_storage():
+    print("Switching to local storage due to error")
+    use_backend(LocalBackend(local_memory_storage))
+
+class MemoryWriteBatch:
+    """
+    Unit of work for storage writes made during one request.
+
+    save_memory calls are collected here instead of hitting storage.
+    Repeated keys are coalesced (the last value wins; importance and source
+    come from the first save, as they would for an existing row). flush()
+    hands them to the backend's write_batch, which for Anvil tables is one
+    search for unknown rows, one batched update and one add_rows call.
+    """
+
+    def __init__(self):
+        self.writes = {}  # (memory_type, key) -> pending write
+        self.boosts = {}  # (memory_type, key) -> pending importance boost
+
+    def __len__(self):
+        return len(self.writes) + len(self.boosts)
+
+    def add(self, memory_type, key, value, importance, source):
+        now = datetime.datetime.now()
+        pending = self.writes.get((memory_type, key))
+        if pending:
+            pending["value"] = value
+            pending["updated_at"] = now
+        else:
+            self.writes[(memory_type, key)] = {
+                "memory_type": memory_type,
+                "key": key,
+                "value": value,
+                "created_at": now,
+                "updated_at": now,
+                "importance": importance,
+                "source": source,
+                "is_expired": False
+            }
+
+    def reinforce(self, memory_type, key, amount):
+        self.boosts[(memory_type, key)] = self.boosts.get((memory_type, key), 0) + amount
+
+    def flush(self):
+        """Write all pending memories to storage. Returns the number written."""
+        if not self.writes and not self.boosts:
+            return 0
+
+        writes, self.writes = self.writes, {}
+        boosts, self.boosts = self.boosts, {}
+        if writes:
+            try:
+                backend.write_batch(writes)
+                print(f"Flushed {len(writes)} memory writes to {backend.name} storage")
+                for memory_type in {write["memory_type"] for write in writes.values()}:
+                    query_cache.invalidate(memory_type)
+            except Exception as e:
+                # Fall back to one save per memory, which has its own error handling
+                print(f"Batched memory flush failed ({e}), writing individually")
+                for write in writes.values():
+                    _write_memory(write["memory_type"], write["key"], write["value"],
+                                  write["importance"], write["source"])
+        if boosts:
+            try:
+                backend.reinforce(boosts)
+            except Exception as e:
+                print(f"Error reinforcing memories: {e}")
+        return len(writes) + len(boosts)
+
+def current_memory_batch():
+    """The unit of work active on this thread, or None"""
+    return getattr(_batch_state, "batch", None)
+
+class memory_batch:
+    """
+    Context manager that gathers save_memory calls on this thread into one
+    MemoryWriteBatch and flushes it on exit. Nested uses join the outer batch.
+    """
+
+    def __enter__(self):
+        self._outer = current_memory_batch()
+        if self._outer is None:
+            _batch_state.batch = MemoryWriteBatch()
+        return _batch_state.batch
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._outer is None:
+            batch = _batch_state.batch
+            _batch_state.batch = None
+            batch.flush()
+        return False
+
+def batched_memory_writes(func):
+    """Decorator running a whole request inside a memory_batch"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with memory_batch():
+            return func(*args, **kwargs)
+    return wrapper
+
 @anvil.server.callable
-def save_memory(memory_type, key, value, importance=5, source="conversation"):
-    """Save a piece of information to persistent memory"""
-    global USE_LOCAL_STORAGE  # Ensure global variable is accessible
+def save_memory(memory_type, key, value, importance=5, source="conversation", merge_duplicates=True):
+    """
+    Save a piece of information to persistent memory. A new memory that
+    nearly duplicates an existing one of the same type is merged into it
+    unless merge_duplicates is False.
+    """
     try:
         # Print what we're saving for debugging
         print(f"SAVING MEMORY: {memory_type} - {key}: {value}")
         
-        if USE_LOCAL_STORAGE:
-            # Use local in-memory storage (fallback)
-            now = datetime.datetime.now()
-            
-            # Check for existing memory
-            existing = None
-            for i, memory in enumerate(local_memory_storage):
-                if memory.get("memory_type") == memory_type and memory.get("key") == key:
-                    existing = memory
-                    existing_index = i
-                    break
-                    
-            if existing:
-                # Update existing
-                existing["value"] = value
-                existing["updated_at"] = now
-                local_memory_storage[existing_index] = existing
-            else:
-                # Create new
-                local_memory_storage.append({
-                    "memory_type": memory_type,
-                    "key": key,
-                    "value": value,
-                    "created_at": now,
-                    "updated_at": now,
-                    "importance": importance,
-                    "source": source,
-                    "is_expired": False
-                })
+        duplicate = merge_duplicates and _find_near_duplicate(memory_type, key, value)
+        if duplicate:
+            print(f"Merged into near-duplicate memory: {duplicate[0]} - {duplicate[1]}")
+            _reinforce_memory(*duplicate)
+            return True
+        
+        batch = current_memory_batch()
+        if batch is not None and backend.defer_writes:
+            # Deferred until the request's unit of work is flushed; indexes are
+            # updated now so retrieval sees the memory straight away
+            batch.add(memory_type, key, value, importance, source)
+            _index_memory(memory_type, key, value, importance)
+            return True
+        return _write_memory(memory_type, key, value, importance, source)
+    except Exception as e:
+        print(f"Error saving memory: {e}")
+        # Fall back to local storage if an unexpected error occurs
+        if not USE_LOCAL_STORAGE:
+            _fall_back_to_local_storage()
+            return save_memory(memory_type, key, value, importance, source, merge_duplicates)
+        return False
+
+def _find_near_duplicate(memory_type, key, value):
+    """(memory_type, key) of an existing memory `value` nearly duplicates, or None"""
+    if not MERGE_NEAR_DUPLICATES or memory_type == MEMORY_TYPES["STATE"]:
+        return None
+    check_storage_version()
+    ensure_indexes_built(("duplicates",))
+    batch = current_memory_batch()
+    if (memory_type, key) in duplicate_index or (batch and (memory_type, key) in batch.writes):
+        return None  # An update of this memory, not a new one
+    duplicate = duplicate_index.find_duplicate(value, accept=lambda doc_id: doc_id[0] == memory_type)
+    if duplicate is None or (batch and duplicate in batch.writes):
+        return duplicate
+    record = backend.get(*duplicate)
+    if not record or record["is_expired"]:
+        # Deleted or expired behind the index; save the new memory instead
+        drop_from_indexes(*duplicate)
+        return None
+    return duplicate
+
+def _reinforce_memory(memory_type, key):
+    batch = current_memory_batch()
+    if batch is not None and backend.defer_writes:
+        batch.reinforce(memory_type, key, DUPLICATE_IMPORTANCE_BOOST)
+        return
+    try:
+        backend.reinforce({(memory_type, key): DUPLICATE_IMPORTANCE_BOOST})
+    except Exception as e:
+        print(f"Error reinforcing memory {memory_type} - {key}: {e}")
+
+def _write_memory(memory_type, key, value, importance=5, source="conversation"):
+    """Write a single memory straight to storage"""
+    try:
+        _, created = backend.upsert(memory_type, key, value, importance, source)
+        query_cache.invalidate(memory_type)
+        if created:
+            print(f"Created new memory: {memory_type} - {key}")
         else:
-            # Use Anvil tables
-            try:
-                # Try to find existing memory
-                existing = app_tables.memories.get(memory_type=memory_type, key=key)
-                
-                if existing:
-                    # Update existing memory
-                    existing["value"] = value
-                    existing["updated_at"] = datetime.datetime.now()
-                    print(f"Updated existing memory: {memory_type} - {key}")
-                else:
-                    # Create new memory
-                    app_tables.memories.add_row(
-                        memory_type=memory_type,
-                        key=key,
-                        value=value,
-                        created_at=datetime.datetime.now(),
-                        updated_at=datetime.datetime.now(),
-                        importance=importance,
-                        source=source,
-                        is_expired=False
-                    )
-                    print(f"Created new memory: {memory_type} - {key}")
-            except Exception as table_error:
-                print(f"Error with Anvil tables, details: {table_error}")
-                # If there's a table error, verify if the memories table exists
-                try:
-                    # Check if 'memories' table exists by listing its columns
-                    app_tables.memories.list_columns()
-                    print("'memories' table exists but encountered error")
-                except:
-                    print("'memories' table does not exist - needs to be created")
-                    # Switch to local storage as fallback
-                    USE_LOCAL_STORAGE = True
-                    # Try again with local storage
-                    return save_memory(memory_type, key, value, importance, source)
-                
+            print(f"Updated existing memory: {memory_type} - {key}")
+        _index_memory(memory_type, key, value, importance)
         return True
     except Exception as e:
-        print(f"Error saving memory: {e}")
+        print(f"Error saving memory to {backend.name} storage: {e}")
         # Fall back to local storage if an unexpected error occurs
         if not USE_LOCAL_STORAGE:
-            USE_LOCAL_STORAGE = True
-            print("Switching to local storage due to error")
-            return save_memory(memory_type, key, value, importance, source)
+            _fall_back_to_local_storage()
+            return _write_memory(memory_type, key, value, importance, source)
         return False
 
 @anvil.server.callable
-def get_memory(memory_type=None, key=None):
-    """Retrieve memories, optionally filtered by type and/or key"""
+def get_memory(memory_type=None, key=None, include_expired=False):
+    """
+    Retrieve memories, optionally filtered by type and/or key. Expired
+    memories are left out (by the storage query) unless include_expired.
+    """
     try:
-        if USE_LOCAL_STORAGE or not HAS_TABLES:
-            # Use local in-memory storage
-            if memory_type and key:
-                for memory in local_memory_storage:
-                    if memory.get("memory_type") == memory_type and memory.get("key") == key:
-                        return {"type": memory["memory_type"], "key": memory["key"], "value": memory["value"]}
+        check_storage_version()
+        if memory_type and key:
+            # Writes still pending in this request's unit of work win
+            batch = current_memory_batch()
+            pending = batch and batch.writes.get((memory_type, key))
+            if pending:
+                return _to_memory_dict(pending)
+            hot = hot_tier.get((memory_type, key))
+            if hot:
+                return {"type": hot["type"], "key": hot["key"], "value": hot["value"]}
+            memory = backend.get(memory_type, key)
+            if not memory or (memory["is_expired"] and not include_expired):
                 return None
-            elif memory_type:
-                return [{"type": m["memory_type"], "key": m["key"], "value": m["value"]} 
-                        for m in local_memory_storage if m.get("memory_type") == memory_type]
-            else:
-                # Return all memories
-                return [{"type": m["memory_type"], "key": m["key"], "value": m["value"]} 
-                        for m in local_memory_storage]
+            if not memory["is_expired"] and memory_type != MEMORY_TYPES["STATE"]:
+                # Used just now, so it belongs in the hot tier
+                hot_tier.put(memory_type, key, memory["value"], memory["importance"])
+            return _to_memory_dict(memory)
         else:
-            # Use Anvil tables
-            if memory_type and key:
-                memory = app_tables.memories.get(memory_type=memory_type, key=key)
-                return memory and {"type": memory["memory_type"], "key": memory["key"], "value": memory["value"]}
-            elif memory_type:
-                memories = app_tables.memories.search(memory_type=memory_type)
-                return [{"type": m["memory_type"], "key": m["key"], "value": m["value"]} for m in memories]
-            else:
-                # Return all memories
-                memories = app_tables.memories.search()
-                return [{"type": m["memory_type"], "key": m["key"], "value": m["value"]} for m in memories]
+            # All memories, or all of one type
+            return _list_memories(memory_type, include_expired)
     except Exception as e:
         print(f"Error retrieving memory: {e}")
         return []
 
+def _list_memories(memory_type, include_expired):
+    """
+    Memory listing for get_memory, read through the query cache. Writes
+    still pending in this request's unit of work are merged in (not cached).
+    """
+    memories = query_cache.get(
+        memory_type, include_expired,
+        lambda: [_to_memory_dict(m) for m in backend.search(memory_type, include_expired)]
+    )
+    # Copies, so callers can't modify the cached listing
+    memories = [dict(m) for m in memories]
+    batch = current_memory_batch()
+    pending = {type_and_key: write for type_and_key, write in (batch.writes.items() if batch else ())
+               if not memory_type or type_and_key[0] == memory_type}
+    if pending:
+        memories = [m for m in memories if (m["type"], m["key"]) not in pending]
+        memories += [_to_memory_dict(write) for write in pending.values()]
+    return memories
+
+@anvil.server.callable
+def get_memory_cache_stats():
+    """Query cache size and hit rate"""
+    lookups = query_cache.stats["hits"] + query_cache.stats["misses"]
+    return dict(query_cache.stats, cached_queries=len(query_cache), ttl=query_cache.ttl,
+                hit_rate=query_cache.stats["hits"] / lookups if lookups else None)
+
+def get_memory_record(memory_type, key):
+    """Return the full stored record (all table columns) for one memory, or None"""
+    return backend.get(memory_type, key)
+
+@anvil.server.callable
+def query_memories(order_by="updated_at", descending=True, limit=10, cursor=None, memory_type=None,
+                   min_importance=None, updated_since=None, include_expired=True):
+    """
+    Paginated memory query. Sorting and the limit are pushed down to
+    storage, so only `limit` rows are read however large the table is.
+    
+    Returns {"memories": [...], "next_cursor": str or None}; pass
+    next_cursor back in to fetch the following page.
+    """
+    if order_by not in ORDERABLE_COLUMNS:
+        raise ValueError(f"order_by must be one of {ORDERABLE_COLUMNS}")
+    
+    # Fetch one extra row to learn whether another page exists
+    records = backend.query(
+        order_by=order_by, descending=descending, limit=limit + 1, after=decode_cursor(cursor),
+        memory_type=memory_type, min_importance=min_importance, updated_since=updated_since,
+        include_expired=include_expired, exclude_types=() if memory_type else (MEMORY_TYPES["STATE"],)
+    )
+    page = records[:limit]
+    next_cursor = encode_cursor(page[-1], order_by) if len(records) > limit and page else None
+    return {
+        "memories": [
+            {
+                "type": m["memory_type"],
+                "key": m["key"],
+                "value": m["value"],
+                "importance": m["importance"],
+                "created": m["created_at"],
+                "updated": m["updated_at"]
+            }
+            for m in page
+        ],
+        "next_cursor": next_cursor
+    }
+
+def expire_memory(memory_type, key):
+    """Mark a memory expired in storage and remove it from retrieval"""
+    backend.update(memory_type, key, is_expired=True)
+    query_cache.invalidate(memory_type)
+    drop_from_indexes(memory_type, key)
+    hot_tier.discard(memory_type, key)
+
+def invalidate_cached_memory(memory_type, key):
+    """Drop cached copies of a memory whose row was modified directly"""
+    backend.invalidate(memory_type, key)
+    query_cache.invalidate(memory_type)
+
+def _memory_text(key, value):
+    """Text that retrieval indexes see for a memory"""
+    return f"{key} {value}"
+
+def _index_memory(memory_type, key, value, importance=None):
+    if memory_type == MEMORY_TYPES["STATE"]:
+        return
+    # Indexes not built yet pick the memory up from storage (or the batch) when they are
+    for name, index in memory_indexes.items():
+        if name in _built_indexes:
+            index.add((memory_type, key), _memory_text(key, value))
+    if "duplicates" in _built_indexes:
+        duplicate_index.add((memory_type, key), value)
+    if (memory_type, key) in hot_tier:
+        hot_tier.refresh(memory_type, key, value)
+    elif hot_tier.is_important(importance):
+        hot_tier.put(memory_type, key, value, importance)
+
+def drop_from_indexes(memory_type, key):
+    """Remove a memory from every retrieval index (e.g. once it has expired)"""
+    for index in memory_indexes.values():
+        index.remove((memory_type, key))
+    duplicate_index.remove((memory_type, key))
+
+def ensure_indexes_built(names=None):
+    """
+    Backfill the named indexes (retrieval engines, or "duplicates" for the
+    near-duplicate index; all of them by default) if they have not yet seen
+    the stored memories. Each build is one scan of storage, so callers only
+    ask for the indexes they are about to use.
+    """
+    wanted = names or list(memory_indexes) + ["duplicates"]
+    pending = [name for name in wanted if name not in _built_indexes
+               and (name == "duplicates" or name in memory_indexes)]
+    if not pending:
+        return
+
+    records = {(r["memory_type"], r["key"]): r for r in backend.search(include_expired=False)}
+    batch = current_memory_batch()
+    if batch:
+        records.update(batch.writes)  # Saved this request but not flushed yet
+    memories = [_to_memory_dict(r) for r in records.values() if r["memory_type"] != MEMORY_TYPES["STATE"]]
+    items = [((m["type"], m["key"]), _memory_text(m["key"], m["value"])) for m in memories]
+    for name in pending:
+        if name == "duplicates":
+            duplicate_index.add_many(((m["type"], m["key"]), m["value"]) for m in memories)
+        else:
+            memory_indexes[name].add_many(items)
+        _built_indexes.add(name)
+        print(f"Built {name} index over {len(items)} memories")
+
+def use_embedder(embedder):
+    """Switch the embedder behind the vector indexes; they are rebuilt on next use"""
+    if "vector" not in memory_indexes:
+        raise RuntimeError("Vector index unavailable (numpy not installed)")
+    for name in ("vector", "ann"):
+        if name in memory_indexes:
+            memory_indexes[name].set_embedder(embedder)
+            _built_indexes.discard(name)
+
+def enable_ann_index(nprobe=None):
+    """Start maintaining the approximate (IVF) index alongside the exact ones"""
+    if "ann" not in memory_indexes:
+        if not HAS_NUMPY:
+            raise RuntimeError("ANN index unavailable (numpy not installed)")
+        memory_indexes["ann"] = IVFIndex(embedder=memory_indexes["vector"].embedder)
+    if nprobe:
+        memory_indexes["ann"].nprobe = nprobe
+    ensure_indexes_built(("ann",))
+    return memory_indexes["ann"]
+
+def _warm_hot_tier():
+    """Seed the hot tier with the most important live memories (once per storage backend)"""
+    global _hot_tier_warmed
+    if _hot_tier_warmed:
+        return
+    _hot_tier_warmed = True
+    records = backend.query(order_by="importance", limit=hot_tier.capacity // 2,
+                            min_importance=hot_tier.min_importance, include_expired=False,
+                            exclude_types=(MEMORY_TYPES["STATE"],))
+    for record in records:
+        hot_tier.put(record["memory_type"], record["key"], record["value"], record["importance"])
+
+@anvil.server.callable
+def get_memory_tier_stats():
+    """Hot tier size and hit rate"""
+    lookups = hot_tier.stats["hits"] + hot_tier.stats["misses"]
+    return dict(hot_tier.stats, hot_memories=len(hot_tier), capacity=hot_tier.capacity,
+                hit_rate=hot_tier.stats["hits"] / lookups if lookups else None)
+
+def _relevance_index():
+    engine = RELEVANCE_ENGINE if RELEVANCE_ENGINE in memory_indexes else "keyword"
+    return memory_indexes[engine]
+
+def _lookup_memories(doc_ids):
+    """Resolve index doc ids back to get_memory-style dicts"""
+    memories = []
+    for memory_type, key in doc_ids:
+        memory = get_memory(memory_type, key)
+        if memory:
+            memories.append(memory)
+    return memories
+
 def extract_and_save_memories(user_message, assistant_response):
     """Extract and save potential memories from the conversation"""
     print("EXTRACTING MEMORIES from message:", user_message)
@@ -156,28 +609,28 @@ def extract_and_save_memories(user_message, assistant_response):
     # This is a simple implementation - you can make this more sophisticated
     # with NLP or by having the LLM explicitly identify memories
     
+    # One pass over the message classifies it against every keyword category
+    # (whole words only, see keyword_matcher.KEYWORD_CATEGORIES)
+    matches = keyword_matcher.classify(user_message)
+    
     # Example: Extract user preferences
-    preference_keywords = ["like", "love", "hate", "prefer", "favorite", "enjoy"]
-    for keyword in preference_keywords:
-        if keyword in user_message.lower():
-            # Very simple extraction - you'll want something more robust
-            memory_key = f"preference_{keyword}"
-            memory_value = f"User mentioned they {keyword}: {user_message}"
-            save_memory(MEMORY_TYPES["PREFERENCE"], memory_key, memory_value)
-            print(f"SAVED PREFERENCE: {memory_key} = {memory_value}")
+    for keyword in matches.get("preference", []):
+        # Very simple extraction - you'll want something more robust
+        memory_key = f"preference_{keyword}"
+        memory_value = f"User mentioned they {keyword}: {user_message}"
+        save_memory(MEMORY_TYPES["PREFERENCE"], memory_key, memory_value)
+        print(f"SAVED PREFERENCE: {memory_key} = {memory_value}")
     
     # Extract emotional states
-    emotion_keywords = ["happy", "sad", "angry", "excited", "worried", "anxious", "longing"]
-    for keyword in emotion_keywords:
-        if keyword in user_message.lower():
-            memory_key = f"emotion_{keyword}"
-            memory_value = f"User expressed feeling {keyword}: {user_message}"
-            save_memory(MEMORY_TYPES["EMOTIONAL"], memory_key, memory_value)
-            print(f"SAVED EMOTION: {memory_key} = {memory_value}")
+    for keyword in matches.get("emotion", []):
+        memory_key = f"emotion_{keyword}"
+        memory_value = f"User expressed feeling {keyword}: {user_message}"
+        save_memory(MEMORY_TYPES["EMOTIONAL"], memory_key, memory_value)
+        print(f"SAVED EMOTION: {memory_key} = {memory_value}")
     
     # Extract potential factual information
     # This is very basic - ideally you would use NER or other techniques
-    if any(pronoun in user_message.lower() for pronoun in ["i am", "i'm", "my"]):
+    if matches.get("personal"):
         memory_key = f"factual_{datetime.datetime.now().isoformat()}"
         memory_value = f"User shared personal info: {user_message}"
         save_memory(MEMORY_TYPES["FACTUAL"], memory_key, memory_value)
@@ -191,50 +644,45 @@ def get_relevant_memories(user_message, limit=5):
     """Retrieve memories relevant to the current conversation"""
     print("GETTING RELEVANT MEMORIES for message:", user_message)
     
-    # This is a simple keyword-based relevance system
-    # A more advanced system might use embeddings and semantic search
+    # Relevance is answered from a retrieval index (BM25 by default, so only
+    # the postings of the message's own terms are visited)
+    check_storage_version()
+    ensure_indexes_built(("keyword", RELEVANCE_ENGINE))
+    keyword_index = memory_indexes["keyword"]
+    print(f"TOTAL MEMORIES AVAILABLE: {len(keyword_index)}")
     
-    all_memories = get_memory()
-    print(f"TOTAL MEMORIES AVAILABLE: {len(all_memories)}")
-    
-    if not all_memories:
+    if not len(keyword_index):
         print("NO MEMORIES FOUND")
         # Initialize with a test memory to verify the system is working
         save_memory(MEMORY_TYPES["FACTUAL"], "test_memory", "This is a test memory to verify the system is working")
-        all_memories = get_memory()
-        if not all_memories:
+        if not len(keyword_index):
             return []
     
     # If this is one of the first few messages, return some memories anyway
     # This helps with testing
     if len(conversation_memory) < 5:
         print("RETURNING INITIAL MEMORIES FOR TESTING")
-        return all_memories[:limit]
-    
-    # Simple relevance scoring based on word overlap
-    user_words = set(user_message.lower().split())
-    scored_memories = []
+        return _lookup_memories(keyword_index.doc_ids(limit))
     
-    for memory in all_memories:
-        memory_text = f"{memory['key']} {memory['value']}".lower()
-        memory_words = set(memory_text.split())
-        
-        # Calculate simple overlap score
-        overlap = len(user_words.intersection(memory_words))
-        if overlap > 0:
-            scored_memories.append((overlap, memory))
+    # Hot tier first; the cold tier (the full retrieval index over storage)
+    # is only searched when the hot tier has too few content-word matches
+    _warm_hot_tier()
+    scored_memories = hot_tier.search(user_message, limit)
+    if len(scored_memories) < limit:
+        seen = {doc_id for _, doc_id in scored_memories}
+        cold = [(score, doc_id) for score, doc_id in _relevance_index().search(user_message, limit)
+                if score > 0 and doc_id not in seen]
+        scored_memories += cold[:limit - len(scored_memories)]
     
     # If no matches, return most recent memories
     if not scored_memories:
         print("NO RELEVANT MEMORIES FOUND - RETURNING RECENT ONES")
-        return all_memories[:limit]
+        return _lookup_memories(keyword_index.doc_ids(limit))
         
-    # Sort by relevance score and take top results
-    scored_memories.sort(reverse=True)
-    memories = [memory for _, memory in scored_memories[:limit]]
+    memories = _lookup_memories(doc_id for _, doc_id in scored_memories)
     
     print(f"RELEVANT MEMORIES FOUND: {len(memories)}")
     for memory in memories:
         print(f"  - {memory['type']}: {memory['value']}")
         
-    return memories
\ No newline at end of file
+    return memories
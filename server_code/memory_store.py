@@ -0,0 +1,424 @@
+# memory_store.py
+import datetime
+
+from .vector_index import HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# Columns every stored memory carries (mirrors the `memories` table schema)
+MEMORY_COLUMNS = ("memory_type", "key", "value", "created_at", "updated_at",
+                  "importance", "source", "is_expired")
+
+
+class MemoryStore:
+    """
+    In-process memory store.
+
+    Records are plain dicts with the same columns as the `memories` table.
+    They are held in a hash index keyed by (memory_type, key) plus a
+    per-type secondary index, so upserts and point lookups are O(1) and
+    reads filtered by type are O(k) in the size of that type.
+    """
+
+    def __init__(self):
+        self._records = {}  # (memory_type, key) -> record
+        self._by_type = {}  # memory_type -> {key: record}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    def __contains__(self, type_and_key):
+        return type_and_key in self._records
+
+    def clear(self):
+        self._records.clear()
+        self._by_type.clear()
+
+    def get(self, memory_type, key):
+        """Return the record for (memory_type, key) or None"""
+        return self._records.get((memory_type, key))
+
+    def by_type(self, memory_type):
+        """Return all records of one memory type"""
+        return list(self._by_type.get(memory_type, {}).values())
+
+    def all(self):
+        """Return all records"""
+        return list(self._records.values())
+
+    def select(self, memory_type=None, include_expired=True):
+        """Records, optionally of one type and/or without expired ones"""
+        records = self.by_type(memory_type) if memory_type else self.all()
+        if include_expired:
+            return records
+        return [record for record in records if not record["is_expired"]]
+
+    def types(self):
+        return list(self._by_type.keys())
+
+    def put(self, record):
+        """Insert or replace a full record, returning it"""
+        memory_type, key = record["memory_type"], record["key"]
+        self._records[(memory_type, key)] = record
+        self._by_type.setdefault(memory_type, {})[key] = record
+        return record
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation", now=None):
+        """
+        Update the value of an existing memory (reviving it if it had
+        expired) or create a new one. Returns (record, created).
+        """
+        now = now or datetime.datetime.now()
+        existing = self._records.get((memory_type, key))
+        if existing is not None:
+            existing["value"] = value
+            existing["updated_at"] = now
+            existing["is_expired"] = False
+            return existing, False
+
+        record = {
+            "memory_type": memory_type,
+            "key": key,
+            "value": value,
+            "created_at": now,
+            "updated_at": now,
+            "importance": importance,
+            "source": source,
+            "is_expired": False
+        }
+        return self.put(record), True
+
+    def remove(self, memory_type, key):
+        """Drop a record, returning it (or None if it was not stored)"""
+        record = self._records.pop((memory_type, key), None)
+        if record is not None:
+            type_index = self._by_type.get(memory_type)
+            if type_index is not None:
+                type_index.pop(key, None)
+                if not type_index:
+                    del self._by_type[memory_type]
+        return record
+
+    def update(self, memory_type, key, **fields):
+        """Set columns on an existing record, returning it (or None)"""
+        record = self._records.get((memory_type, key))
+        if record is not None:
+            record.update(fields)
+        return record
+
+
+# Sentinel for a missing importance in the int8 column
+_NO_IMPORTANCE = -1
+# Sentinel length for a missing value in the string table
+_NO_VALUE = -1
+# Rewrite the string table once this share of it belongs to replaced values
+STRING_TABLE_MAX_GARBAGE = 0.5
+
+
+def _epoch(value):
+    return np.nan if value is None else value.timestamp()
+
+
+def _datetime(epoch):
+    return None if np.isnan(epoch) else datetime.datetime.fromtimestamp(epoch)
+
+
+class ColumnarMemoryStore:
+    """
+    In-process memory store laid out as columns.
+
+    memory_type and source are interned to small integer codes, timestamps
+    are float64 epoch seconds, importance is int8 and the expired flag is a
+    bool array. Values are UTF-8 in one append-only string table addressed
+    by (offset, length) columns, rewritten once replaced values make up
+    most of it; keys stay Python strings since they back the lookup index.
+    Rows freed by remove() are reused. Filtering and ordering (query) run vectorized over
+    the arrays, and dict records are only built for the rows returned, so
+    callers get the same records MemoryStore hands out (as copies: change
+    them through upsert/update).
+    """
+
+    def __init__(self, initial_capacity=1024):
+        if not HAS_NUMPY:
+            raise RuntimeError("ColumnarMemoryStore requires numpy")
+        self._initial_capacity = initial_capacity
+        self.clear()
+
+    def clear(self):
+        capacity = self._initial_capacity
+        self._type = np.zeros(capacity, dtype=np.int16)
+        self._source = np.zeros(capacity, dtype=np.int16)
+        self._created = np.full(capacity, np.nan)
+        self._updated = np.full(capacity, np.nan)
+        self._importance = np.full(capacity, _NO_IMPORTANCE, dtype=np.int8)
+        self._expired = np.zeros(capacity, dtype=bool)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._value_offset = np.zeros(capacity, dtype=np.int64)
+        self._value_length = np.full(capacity, _NO_VALUE, dtype=np.int32)
+        self._text = bytearray()  # string table holding every value
+        self._garbage = 0  # bytes of the string table no row points at
+        self._keys = [None] * capacity
+        self._size = 0  # rows in use, including freed ones below it
+        self._free = []  # freed rows available for reuse
+        self._rows = {}  # type code -> {key: row}
+        self._type_names = []  # code -> memory_type
+        self._type_codes = {}  # memory_type -> code
+        self._source_names = []
+        self._source_codes = {}
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __contains__(self, type_and_key):
+        return self._row(*type_and_key) is not None
+
+    @staticmethod
+    def _intern(value, names, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def _row(self, memory_type, key):
+        code = self._type_codes.get(memory_type)
+        if code is None:
+            return None
+        return self._rows.get(code, {}).get(key)
+
+    def _reserve(self):
+        capacity = len(self._keys)
+        if self._size < capacity:
+            return
+        grown = capacity * 2
+        for name in ("_type", "_source", "_created", "_updated", "_importance", "_expired", "_live",
+                     "_value_offset", "_value_length"):
+            column = getattr(self, name)
+            extended = np.empty(grown, dtype=column.dtype)
+            extended[:capacity] = column
+            extended[capacity:] = {"_created": np.nan, "_updated": np.nan, "_importance": _NO_IMPORTANCE,
+                                   "_value_length": _NO_VALUE}.get(name, 0)
+            setattr(self, name, extended)
+        self._keys.extend([None] * capacity)
+
+    def _value(self, row):
+        length = self._value_length[row]
+        if length == _NO_VALUE:
+            return None
+        offset = self._value_offset[row]
+        return self._text[offset:offset + length].decode("utf-8")
+
+    def _release_value(self, row):
+        if self._value_length[row] > 0:
+            self._garbage += int(self._value_length[row])
+        self._value_length[row] = _NO_VALUE
+
+    def _store_value(self, row, value):
+        self._release_value(row)
+        if value is None:
+            return
+        data = str(value).encode("utf-8")
+        self._value_offset[row] = len(self._text)
+        self._value_length[row] = len(data)
+        self._text += data
+        if self._garbage > STRING_TABLE_MAX_GARBAGE * len(self._text):
+            self._compact_text()
+
+    def _compact_text(self):
+        """Rewrite the string table with only the values rows still point at"""
+        text = bytearray()
+        for row in np.flatnonzero(self._value_length[:self._size] > 0).tolist():
+            offset, length = self._value_offset[row], self._value_length[row]
+            self._value_offset[row] = len(text)
+            text += self._text[offset:offset + length]
+        self._text = text
+        self._garbage = 0
+
+    def _record(self, row):
+        importance = int(self._importance[row])
+        return {
+            "memory_type": self._type_names[self._type[row]],
+            "key": self._keys[row],
+            "value": self._value(row),
+            "created_at": _datetime(self._created[row]),
+            "updated_at": _datetime(self._updated[row]),
+            "importance": None if importance == _NO_IMPORTANCE else importance,
+            "source": self._source_names[self._source[row]],
+            "is_expired": bool(self._expired[row])
+        }
+
+    def _set(self, row, fields):
+        for column, value in fields.items():
+            if column == "value":
+                self._store_value(row, value)
+            elif column == "created_at":
+                self._created[row] = _epoch(value)
+            elif column == "updated_at":
+                self._updated[row] = _epoch(value)
+            elif column == "importance":
+                self._importance[row] = (_NO_IMPORTANCE if value is None
+                                         else max(0, min(127, int(round(value)))))
+            elif column == "source":
+                self._source[row] = self._intern(value, self._source_names, self._source_codes)
+            elif column == "is_expired":
+                self._expired[row] = bool(value)
+
+    def get(self, memory_type, key):
+        row = self._row(memory_type, key)
+        return None if row is None else self._record(row)
+
+    def by_type(self, memory_type):
+        code = self._type_codes.get(memory_type)
+        if code is None:
+            return []
+        return [self._record(row) for row in sorted(self._rows.get(code, {}).values())]
+
+    def all(self):
+        return [self._record(row) for row in np.flatnonzero(self._live[:self._size])]
+
+    def select(self, memory_type=None, include_expired=True):
+        """Records, optionally of one type and/or without expired ones (filtered on the columns)"""
+        mask = self._live[:self._size].copy()
+        if memory_type:
+            if memory_type not in self._type_codes:
+                return []
+            mask &= self._type[:self._size] == self._type_codes[memory_type]
+        if not include_expired:
+            mask &= ~self._expired[:self._size]
+        return [self._record(row) for row in np.flatnonzero(mask).tolist()]
+
+    def types(self):
+        return [self._type_names[code] for code, rows in self._rows.items() if rows]
+
+    def put(self, record):
+        """Insert or replace a full record, returning the stored copy"""
+        memory_type, key = record["memory_type"], record["key"]
+        row = self._row(memory_type, key)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                self._reserve()
+                row = self._size
+                self._size += 1
+            code = self._intern(memory_type, self._type_names, self._type_codes)
+            self._type[row] = code
+            self._keys[row] = key
+            self._live[row] = True
+            self._rows.setdefault(code, {})[key] = row
+        self._set(row, {column: record.get(column) for column in MEMORY_COLUMNS[2:]})
+        return self._record(row)
+
+    def upsert(self, memory_type, key, value, importance=5, source="conversation", now=None):
+        """
+        Update the value of an existing memory (reviving it if it had
+        expired) or create a new one. Returns (record, created).
+        """
+        now = now or datetime.datetime.now()
+        row = self._row(memory_type, key)
+        if row is not None:
+            self._set(row, {"value": value, "updated_at": now, "is_expired": False})
+            return self._record(row), False
+
+        return self.put({
+            "memory_type": memory_type,
+            "key": key,
+            "value": value,
+            "created_at": now,
+            "updated_at": now,
+            "importance": importance,
+            "source": source,
+            "is_expired": False
+        }), True
+
+    def update(self, memory_type, key, **fields):
+        """Set columns on an existing record, returning it (or None)"""
+        row = self._row(memory_type, key)
+        if row is None:
+            return None
+        self._set(row, fields)
+        return self._record(row)
+
+    def remove(self, memory_type, key):
+        """Drop a record, returning it (or None if it was not stored)"""
+        row = self._row(memory_type, key)
+        if row is None:
+            return None
+        record = self._record(row)
+        del self._rows[self._type[row]][key]
+        self._live[row] = False
+        self._keys[row] = None
+        self._release_value(row)
+        self._free.append(row)
+        return record
+
+    def _order_column(self, order_by):
+        if order_by == "importance":
+            values = self._importance[:self._size].astype(np.float64)
+            values[values == _NO_IMPORTANCE] = np.nan
+            return values
+        return {"updated_at": self._updated, "created_at": self._created}[order_by][:self._size]
+
+    def query(self, order_by="updated_at", descending=True, limit=10, after=None, memory_type=None,
+              min_importance=None, updated_since=None, include_expired=True, exclude_types=()):
+        """
+        Same contract as MemoryBackend.query, evaluated over the columns:
+        filters are boolean masks and only rows that can make the page are
+        turned into records and fully ordered.
+        """
+        size = self._size
+        mask = self._live[:size].copy()
+        if memory_type:
+            if memory_type not in self._type_codes:
+                return []
+            mask &= self._type[:size] == self._type_codes[memory_type]
+        for excluded in exclude_types:
+            if excluded in self._type_codes:
+                mask &= self._type[:size] != self._type_codes[excluded]
+        if not include_expired:
+            mask &= ~self._expired[:size]
+        if min_importance is not None:
+            mask &= (self._importance[:size] != _NO_IMPORTANCE) & (self._importance[:size] >= min_importance)
+        if updated_since is not None:
+            mask &= self._updated[:size] >= _epoch(updated_since)
+
+        order_values = self._order_column(order_by)
+        mask &= ~np.isnan(order_values)
+        if after is not None:
+            bound = after[0].timestamp() if isinstance(after[0], datetime.datetime) else after[0]
+            mask &= order_values <= bound if descending else order_values >= bound
+            # Rows tied with the cursor on the order value are decided by (memory_type, key)
+            for row in np.flatnonzero(mask & (order_values == bound)).tolist():
+                position = (self._type_names[self._type[row]], self._keys[row])
+                if (position >= after[1:]) if descending else (position <= after[1:]):
+                    mask[row] = False
+
+        rows = np.flatnonzero(mask)
+        if limit <= 0 or not len(rows):
+            return []
+        values = order_values[rows]
+        if len(rows) > limit:
+            # Keep every row tied with the limit-th value so tie-breaks stay exact
+            kth = np.partition(-values if descending else values, limit - 1)[limit - 1]
+            keep = values >= -kth if descending else values <= kth
+            rows, values = rows[keep], values[keep]
+
+        # Order by (value, memory_type, key); lexsort's last key is the primary one
+        type_rank = np.argsort(np.argsort(self._type_names))
+        keys = np.array([self._keys[row] for row in rows.tolist()])
+        order = np.lexsort((keys, type_rank[self._type[rows]], values))
+        if descending:
+            order = order[::-1]
+        return [self._record(row) for row in rows[order[:limit]].tolist()]
+
+
+def new_local_store():
+    """Columnar store when numpy is available, dict-of-records otherwise"""
+    return ColumnarMemoryStore() if HAS_NUMPY else MemoryStore()
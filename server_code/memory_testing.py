@@ -6,7 +6,7 @@ from . import memory_state
 def initialize_test_memories():
     """Create some test memories to verify the system is working"""
     # Clear existing memories for testing
-    memory_state.local_memory_storage.clear()
+    memory_state.clear_local_memories()
     
     # Add some test memories
     test_memories = [
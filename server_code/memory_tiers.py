@@ -0,0 +1,109 @@
+# memory_tiers.py
+import threading
+from collections import OrderedDict
+
+from .keyword_index import BM25Index, content_terms
+
+# Hot tier sizing. Memories at or above HOT_MIN_IMPORTANCE are admitted as
+# soon as they are written and survive one extra round of eviction; any
+# other memory enters the hot tier when it is used.
+HOT_TIER_CAPACITY = 500
+HOT_MIN_IMPORTANCE = 7
+
+
+class HotTier:
+    """
+    Bounded in-RAM tier of memories, kept in least-recently-used order.
+
+    Entries are get_memory-style dicts plus their importance, searchable
+    through a BM25 index over just the hot entries. When the tier is full
+    the least recently used entry is evicted, except that an important
+    entry is given a second chance (moved to the front once) first.
+    Everything else stays in storage, the cold tier.
+    """
+
+    def __init__(self, capacity=HOT_TIER_CAPACITY, min_importance=HOT_MIN_IMPORTANCE):
+        self.capacity = capacity
+        self.min_importance = min_importance
+        self._lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()  # doc_id -> {"type", "key", "value", "importance"}
+            self._second_chance = set()
+            self._index = BM25Index()
+            self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def is_important(self, importance):
+        return importance is not None and importance >= self.min_importance
+
+    def get(self, doc_id):
+        """The hot entry for doc_id (marking it used), or None"""
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(doc_id)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, memory_type, key, value, importance=None):
+        """Admit or refresh a memory as most recently used"""
+        doc_id = (memory_type, key)
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None and importance is None:
+                importance = entry["importance"]
+            self._entries[doc_id] = {"type": memory_type, "key": key, "value": value, "importance": importance}
+            self._entries.move_to_end(doc_id)
+            if self.is_important(importance):
+                self._second_chance.add(doc_id)
+            self._index.add(doc_id, f"{key} {value}")
+            self._evict()
+
+    def refresh(self, memory_type, key, value):
+        """Update the value of a memory if it is hot, without changing its position"""
+        doc_id = (memory_type, key)
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                entry["value"] = value
+                self._index.add(doc_id, f"{key} {value}")
+
+    def discard(self, memory_type, key):
+        doc_id = (memory_type, key)
+        with self._lock:
+            if self._entries.pop(doc_id, None) is not None:
+                self._second_chance.discard(doc_id)
+                self._index.remove(doc_id)
+
+    def _evict(self):
+        while len(self._entries) > self.capacity:
+            doc_id, entry = next(iter(self._entries.items()))
+            if doc_id in self._second_chance:
+                self._second_chance.discard(doc_id)
+                self._entries.move_to_end(doc_id)
+                continue
+            del self._entries[doc_id]
+            self._index.remove(doc_id)
+            self.stats["evictions"] += 1
+
+    def search(self, query, limit=5):
+        """
+        [(score, doc_id)] among hot memories, best first. Only the query's
+        content terms count, so a hot memory sharing nothing but stopwords
+        with the query never stands in for a real match in the cold tier.
+        """
+        terms = content_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            return [(score, doc_id) for score, doc_id in self._index.search(" ".join(terms), limit) if score > 0]
@@ -0,0 +1,143 @@
+# minhash_index.py
+import hashlib
+import heapq
+import itertools
+import random
+
+from .keyword_index import tokenize
+from .vector_index import HAS_NUMPY
+
+if HAS_NUMPY:
+    import numpy as np
+
+# MinHash signature length and LSH banding. With 16 bands of 4 rows, two
+# texts with Jaccard similarity 0.8 or more almost always share a bucket,
+# while pairs below ~0.3 rarely become candidates at all.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+# Candidates at or above this (exact) Jaccard similarity count as
+# near-duplicates. Memory values share templates ("User mentioned they
+# like: ..."), so this is kept high enough that a different name or place
+# in an otherwise identical sentence is not merged.
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+# Hash universe: (a * h + b) mod p with 31-bit values stays inside uint64
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text):
+    """Feature set compared between texts (distinct word tokens)"""
+    return frozenset(tokenize(text))
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHashIndex:
+    """
+    Locality-sensitive index for finding near-duplicate texts.
+
+    Each text gets a MinHash signature; the signature is cut into bands and
+    the text is filed under one bucket per band. A lookup only compares
+    against texts sharing at least one bucket, so its cost depends on the
+    number of similar texts rather than the size of the index. Candidates
+    are confirmed with the exact Jaccard similarity of their token sets.
+    """
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, bands=LSH_BANDS,
+                 threshold=NEAR_DUPLICATE_THRESHOLD, seed=1):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        rng = random.Random(seed)
+        self._params = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(permutations)]
+        if HAS_NUMPY:
+            self._a = np.array([a for a, _ in self._params], dtype=np.uint64)[:, None]
+            self._b = np.array([b for _, b in self._params], dtype=np.uint64)[:, None]
+        self.bands = bands
+        self.rows = permutations // bands
+        self.threshold = threshold
+        self.clear()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def doc_ids(self, limit=None):
+        return list(itertools.islice(self._docs.keys(), limit))
+
+    def clear(self):
+        self._buckets = {}  # (band, band hash) -> set of doc_ids
+        self._docs = {}  # doc_id -> (shingles, bucket keys)
+
+    def signature(self, features):
+        """MinHash signature (one minimum per permutation) of a feature set"""
+        hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=4).digest(), "little") % _PRIME
+                  for f in features]
+        if HAS_NUMPY:
+            values = np.array(hashes, dtype=np.uint64)[None, :]
+            return ((self._a * values + self._b) % _PRIME).min(axis=1).tolist()
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._params]
+
+    def _bucket_keys(self, features):
+        if not features:
+            return []
+        signature = self.signature(features)
+        return [(band, hash(tuple(signature[band * self.rows:(band + 1) * self.rows])))
+                for band in range(self.bands)]
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        features = shingles(text)
+        keys = self._bucket_keys(features)
+        for bucket_key in keys:
+            self._buckets.setdefault(bucket_key, set()).add(doc_id)
+        self._docs[doc_id] = (features, keys)
+
+    def add_many(self, items):
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return False
+        for bucket_key in entry[1]:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(doc_id)
+                if not bucket:
+                    del self._buckets[bucket_key]
+        return True
+
+    def _candidates(self, features):
+        candidates = set()
+        for bucket_key in self._bucket_keys(features):
+            candidates.update(self._buckets.get(bucket_key, ()))
+        return candidates
+
+    def search(self, query, limit=5):
+        """Return up to `limit` (jaccard, doc_id) pairs among LSH candidates, best first"""
+        features = shingles(query)
+        scored = ((jaccard(features, self._docs[doc_id][0]), doc_id) for doc_id in self._candidates(features))
+        return heapq.nlargest(limit, scored, key=lambda pair: pair[0])
+
+    def find_duplicate(self, text, accept=None):
+        """
+        The most similar stored doc_id whose similarity reaches the threshold,
+        or None. `accept(doc_id)` can restrict which documents may match.
+        """
+        features = shingles(text)
+        best = None
+        best_score = self.threshold
+        for doc_id in self._candidates(features):
+            if accept is not None and not accept(doc_id):
+                continue
+            score = jaccard(features, self._docs[doc_id][0])
+            if score >= best_score:
+                best, best_score = doc_id, score
+        return best
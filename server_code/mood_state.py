@@ -0,0 +1,104 @@
+# mood_state.py
+import datetime
+import json
+import threading
+from collections import deque
+
+from . import memory_state
+
+DEFAULT_MOOD = "neutral and curious"
+MOOD_HISTORY_LIMIT = 50  # Mood changes kept in the time-series
+
+# Materialized rows under the "state" memory type
+CURRENT_MOOD_KEY = "current_mood"
+MOOD_HISTORY_KEY = "mood_history"
+
+_lock = threading.Lock()
+_current_mood = None
+_mood_history = deque(maxlen=MOOD_HISTORY_LIMIT)  # {"mood": ..., "at": iso timestamp}
+_loaded_generation = None  # memory_state.cache_generation the rows were read at
+
+
+def _ensure_loaded():
+    """Read the materialized mood rows once, and again after memory_state drops its caches"""
+    memory_state.check_storage_version()
+    if _loaded_generation != memory_state.cache_generation:
+        _load()
+
+
+def _load():
+    """Read the materialized mood rows (two point lookups)"""
+    global _current_mood, _loaded_generation
+    state_type = memory_state.MEMORY_TYPES["STATE"]
+    _current_mood = None
+    _mood_history.clear()
+
+    current = memory_state.get_memory(state_type, CURRENT_MOOD_KEY)
+    history = memory_state.get_memory(state_type, MOOD_HISTORY_KEY)
+    if history:
+        try:
+            _mood_history.extend(json.loads(history["value"]))
+        except ValueError:
+            print("Ignoring unreadable mood history")
+
+    if current:
+        _current_mood = current["value"]
+    else:
+        _migrate_legacy_moods()
+    _loaded_generation = memory_state.cache_generation
+
+
+def _migrate_legacy_moods():
+    """
+    Seed the materialized state from old per-change `mood_<timestamp>`
+    emotional memories. Only runs when no current_mood row exists yet.
+    """
+    global _current_mood
+    mood_memories = [m for m in memory_state.get_memory(memory_state.MEMORY_TYPES["EMOTIONAL"])
+                     if m["key"].startswith("mood_")]
+    if not mood_memories:
+        return
+
+    mood_memories.sort(key=lambda m: m["key"])
+    for memory in mood_memories[-MOOD_HISTORY_LIMIT:]:
+        _mood_history.append({"mood": memory["value"], "at": memory["key"][len("mood_"):]})
+    _current_mood = mood_memories[-1]["value"]
+    _write_through()
+    print(f"Migrated {len(mood_memories)} legacy mood memories")
+
+
+def _write_through():
+    state_type = memory_state.MEMORY_TYPES["STATE"]
+    memory_state.save_memory(state_type, CURRENT_MOOD_KEY, _current_mood,
+                             importance=6, source="mood_extraction")
+    memory_state.save_memory(state_type, MOOD_HISTORY_KEY, json.dumps(list(_mood_history)),
+                             importance=1, source="mood_extraction")
+
+
+def get_current_mood():
+    """Current mood, in constant time regardless of how many mood changes exist"""
+    with _lock:
+        _ensure_loaded()
+        return _current_mood or DEFAULT_MOOD
+
+
+def set_current_mood(mood):
+    """Record a mood change and write the materialized state through to storage (if it changed)"""
+    global _current_mood
+    if not mood:
+        return
+
+    with _lock:
+        _ensure_loaded()
+        if mood == _current_mood:
+            return
+        _current_mood = mood
+        _mood_history.append({"mood": mood, "at": datetime.datetime.now().isoformat()})
+        _write_through()
+
+
+def get_mood_history(limit=MOOD_HISTORY_LIMIT):
+    """Most recent mood changes, oldest first"""
+    with _lock:
+        _ensure_loaded()
+        return list(_mood_history)[-limit:]
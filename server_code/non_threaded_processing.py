@@ -1,83 +1,96 @@
 # non_threaded_processing.py - Updated version
 import anvil.server
 import time
-import httpx
 import json
 import re
-import datetime
 from . import memory_state
+from . import post_response
+from . import llm_client
+from . import mood_state
+from . import thought_log
+from . import response_streams
+from . import context_window
+from .response_cache import default_cache as response_cache
+from .prompt_builder import build_prompt, stable_prefix_layout, dynamic_context
+
+MAX_REPLY_TOKENS = 1024
 
-# Global state for response tracking - simple version without threading
-response_cache = {}
 
 def get_current_mood():
-    """Get the current mood from memories or default to neutral"""
-    # Try to find the most recent mood memory
-    all_memories = memory_state.get_memory()
-    
-    mood_memories = [m for m in all_memories if 
-                    m['type'] == memory_state.MEMORY_TYPES["EMOTIONAL"] and 
-                    'mood' in m['key'].lower()]
-    
-    if mood_memories:
-        # Sort by recency (assuming key contains timestamp)
-        sorted_moods = sorted(mood_memories, 
-                             key=lambda m: m['key'], 
-                             reverse=True)
-        return sorted_moods[0]['value']
-    else:
-        return "neutral and curious"  # Default mood
+    """Get the current mood from the materialized mood state or default to neutral"""
+    return mood_state.get_current_mood()
 
 def update_current_mood(mood):
-    """Update the current mood in memory"""
+    """Update the current mood (written through to memory)"""
     if not mood:
         return
     
     print(f"Updating current mood: {mood}")
-    
-    # Create timestamp for unique key
-    timestamp = datetime.datetime.now().isoformat()
-    
-    # Store the mood as a memory
-    memory_state.save_memory(
-        memory_type=memory_state.MEMORY_TYPES["EMOTIONAL"],
-        key=f"mood_{timestamp}",
-        value=mood,
-        importance=6,  # Moods are moderately important
-        source="mood_extraction"
-    )
+    mood_state.set_current_mood(mood)
 
 def store_thoughts_in_memory(thoughts, user_message):
-    """Store extracted thoughts as memories"""
+    """Append extracted thoughts to the thought log (kept apart from memories)"""
     if not thoughts:
         return
     
-    print(f"Storing {len(thoughts)} thoughts as memories")
+    thought_log.append(thoughts, user_message)
+
+def persist_turn(parsed, user_message, assistant_reply):
+    """Post-response stage: store thoughts and mood, extract memories"""
+    store_thoughts_in_memory(parsed["thoughts"], user_message)
     
-    for i, thought in enumerate(thoughts):
-        # Create a unique key for each thought
-        timestamp = datetime.datetime.now().isoformat()
-        thought_key = f"thought_{timestamp}_{i}"
-        
-        # Store the thought as a memory
-        memory_state.save_memory(
-            memory_type=memory_state.MEMORY_TYPES["INTERACTION"],
-            key=thought_key,
-            value=f"Thought: {thought}",
-            importance=7,  # Thoughts are important for character continuity
-            source="thought_extraction"
-        )
-        
-        print(f"Stored thought: {thought[:50]}...")
+    # Update mood if a new one was expressed
+    if parsed["mood"]:
+        update_current_mood(parsed["mood"])
+    
+    memory_state.extract_and_save_memories(user_message, assistant_reply)
 
 @anvil.server.callable
 def chat_with_model_direct(user_message):
     """Process chat message directly - no threading but with tag parsing"""
+    return _chat_turn(user_message)
+
+@anvil.server.callable
+def start_chat_stream(user_message):
+    """
+    Start a streamed reply in a background task and return its stream_id
+    at once. Poll read_response_stream for the text as it is generated;
+    the final result matches chat_with_model_direct's.
+    """
+    if not user_message.strip():
+        return {"status": "error", "error": "Empty message"}
+    
+    # The task runs in its own interpreter, so it gets this process's history
+    # and hands back the updated one (applied by read_response_stream)
+    task = anvil.server.launch_background_task("chat_stream_task", user_message,
+                                               list(memory_state.conversation_memory))
+    return {"status": "started", "stream_id": task.get_id()}
+
+@anvil.server.background_task
+def chat_stream_task(user_message, conversation=None):
+    """One chat turn, publishing the reply through task_state as it streams"""
+    if conversation is not None:
+        memory_state.conversation_memory[:] = conversation
+    stream = response_streams.ResponseStream(anvil.server.task_state)
+    result = _chat_turn(user_message, stream)
+    if result["status"] == "success":
+        stream.finish()
+        result["conversation"] = list(memory_state.conversation_memory)
+    else:
+        stream.fail(result["error"])
+    return result
+
+@memory_state.batched_memory_writes
+def _chat_turn(user_message, stream=None):
+    """One chat turn; tokens are also appended to `stream` as they arrive when given"""
     
     if not user_message.strip():
         return {"status": "error", "error": "Empty message"}
 
     try:
+        # Make sure the previous turn's memory writes have landed
+        post_response.wait()
+        
         # Add default system message if it's the first exchange
         if not memory_state.conversation_memory:
             memory_state.conversation_memory.append({
@@ -99,8 +112,12 @@ def chat_with_model_direct(user_message):
         current_mood = get_current_mood()
         mood_text = f"\nCURRENT MOOD: You are currently feeling {current_mood}.\n"
         
+        turn_context = None
+        if stable_prefix_layout():
+            # The system message stays byte-identical; mood and memories follow the history
+            turn_context = dynamic_context(current_mood, relevant_memories)
         # Create an enhanced system message with mood and memories
-        if relevant_memories:
+        elif relevant_memories:
             memory_text = "\nRELEVANT MEMORIES:\n"
             for memory in relevant_memories:
                 memory_text += f"- {memory['type'].upper()}: {memory['value']}\n"
@@ -166,12 +183,11 @@ def chat_with_model_direct(user_message):
         # Add user input
         memory_state.conversation_memory.append({"role": "user", "content": user_message})
 
-        # Select recent context (we can make this token-aware later)
-        context = memory_state.conversation_memory[-20:]  # Limited window size
+        # Select recent context: system message plus as much history as fits the token budget
+        context = context_window.select_context(memory_state.conversation_memory, MAX_REPLY_TOKENS, turn_context)
 
         # Build the prompt using your Jinja2 template
-        from .prompt_builder import build_prompt
-        prompt = build_prompt(context)
+        prompt = build_prompt(context, turn_context)
 
         # 🔍 Debug print to inspect actual rendered prompt
         print("----- Rendered Prompt Start -----")
@@ -196,25 +212,30 @@ def chat_with_model_direct(user_message):
         payload = {
             "model": llm_integration.OPENAI_MODEL,
             "prompt": prompt,
-            "max_tokens": 1024,
+            "max_tokens": MAX_REPLY_TOKENS,
             "temperature": 0.7,
-            "stop": ["<end_of_turn>"]
+            "stop": ["<end_of_turn>"],
+            **llm_client.cache_hints()
         }
 
         # Start timing
         start_time = time.time()
         print(f"Starting LLM request at {start_time}")
         
-        # Make the direct API request - no streaming or threading
-        response = httpx.post(
-            f"{llm_integration.OPENAI_API_BASE}/completions",
-            json=payload,
-            timeout=90  # Long timeout
-        )
-        response.raise_for_status()
-        
-        # Get the raw reply
-        raw_reply = response.json()["choices"][0]["text"].strip()
+        first_token = None
+        if stream is not None:
+            # Tokens reach the client as they arrive (see read_response_stream)
+            tokens = []
+            for token in llm_client.stream_completion(payload, timeout=90):
+                if first_token is None:
+                    first_token = time.time() - start_time
+                    print(f"First token after {first_token:.2f} seconds")
+                tokens.append(token)
+                stream.append(token)
+            raw_reply = "".join(tokens).strip()
+        else:
+            # Make the direct API request - no streaming or threading
+            raw_reply = llm_client.complete(payload, timeout=90)  # Long timeout
         
         # Record timing information
         end_time = time.time()
@@ -223,26 +244,14 @@ def chat_with_model_direct(user_message):
         # Parse tags from the reply
         parsed = parse_special_tags(raw_reply)
         
-        # Store thoughts in memory
-        store_thoughts_in_memory(parsed["thoughts"], user_message)
-        
-        # Update mood if a new one was expressed
-        if parsed["mood"]:
-            update_current_mood(parsed["mood"])
-            
         # Add assistant reply to memory (clean version without tags)
         memory_state.conversation_memory.append({"role": "assistant", "content": parsed["main_text"]})
 
-        # Extract and save memories from this interaction
-        memory_state.extract_and_save_memories(user_message, parsed["main_text"])
+        # Thoughts, mood and memory extraction (after the reply on a persistent server, see post_response)
+        post_response.submit(persist_turn, parsed, user_message, parsed["main_text"])
         
         # Store in cache for any potential later reference
-        response_id = f"resp_{int(time.time())}_{hash(user_message) % 10000}"
-        response_cache[response_id] = {
-            "raw_reply": raw_reply,
-            "parsed": parsed,
-            "timestamp": time.time()
-        }
+        response_id = response_cache.put({"raw_reply": raw_reply, "parsed": parsed})
 
         # Return the parsed result
         return {
@@ -255,7 +264,8 @@ def chat_with_model_direct(user_message):
             "timing": {
                 "started_at": start_time,
                 "completed_at": end_time,
-                "duration": end_time - start_time
+                "duration": end_time - start_time,
+                "first_token": first_token
             }
         }
         
@@ -312,8 +322,9 @@ def parse_special_tags(text):
 @anvil.server.callable
 def get_response_from_cache(response_id):
     """Get a previously processed response from cache"""
-    if response_id in response_cache:
-        return response_cache[response_id]
+    cached = response_cache.get(response_id)
+    if cached is not None:
+        return cached
     else:
         return {"status": "error", "error": f"Response ID {response_id} not found in cache"}
 
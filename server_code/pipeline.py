@@ -1,13 +1,17 @@
 import time
-import datetime
-import httpx
 import re
 
 from . import memory_state
 from . import llm_integration
-from .prompt_builder import build_prompt
+from . import llm_client
+from . import context_window
+from .response_cache import default_cache as response_cache
+from . import post_response
+from . import mood_state
+from . import thought_log
+from .prompt_builder import build_prompt, stable_prefix_layout, dynamic_context
 
-response_cache = {}
+MAX_REPLY_TOKENS = 1024
 
 ### STEP 1: Validate input
 
@@ -21,16 +25,12 @@ def validate_input(state):
 ### STEP 2: Get relevant memories and current mood
 
 def get_relevant_memories_and_mood(state):
+    # Make sure the previous turn's memory writes have landed
+    post_response.wait()
+    
     user_message = state["user_message"]
     state["relevant_memories"] = memory_state.get_relevant_memories(user_message)
-    
-    all_moods = memory_state.get_memory(memory_state.MEMORY_TYPES["EMOTIONAL"])
-    mood_memories = [m for m in all_moods if 'mood' in m['key'].lower()]
-    if mood_memories:
-        sorted_moods = sorted(mood_memories, key=lambda m: m['key'], reverse=True)
-        state["current_mood"] = sorted_moods[0]['value']
-    else:
-        state["current_mood"] = "neutral and curious"
+    state["current_mood"] = mood_state.get_current_mood()
 
 
 ### STEP 3: Inject system prompt
@@ -46,6 +46,11 @@ def build_system_prompt(state):
     else:
         state["system_message"] = memory_state.conversation_memory[0]
 
+    if stable_prefix_layout():
+        # The system message stays as it is; mood and memories follow the history
+        state["turn_context"] = dynamic_context(state["current_mood"], state["relevant_memories"])
+        return
+
     # Attach dynamic mood and memory context
     mood = state["current_mood"]
     mood_text = f"\nCURRENT MOOD: You are currently feeling {mood}.\n"
@@ -74,9 +79,9 @@ def build_system_prompt(state):
 
 def assemble_context_and_prompt(state):
     memory_state.conversation_memory.append({"role": "user", "content": state["user_message"]})
-    context = memory_state.conversation_memory[-llm_integration.MAX_MESSAGES:]
+    context = context_window.select_context(memory_state.conversation_memory, MAX_REPLY_TOKENS, state.get("turn_context"))
     state["context"] = context
-    state["prompt"] = build_prompt(context)
+    state["prompt"] = build_prompt(context, state.get("turn_context"))
 
 
 ### STEP 5: Call the LLM
@@ -85,19 +90,14 @@ def send_prompt_to_llm(state):
     payload = {
         "model": llm_integration.OPENAI_MODEL,
         "prompt": state["prompt"],
-        "max_tokens": 1024,
+        "max_tokens": MAX_REPLY_TOKENS,
         "temperature": 0.7,
-        "stop": ["<end_of_turn>"]
+        "stop": ["<end_of_turn>"],
+        **llm_client.cache_hints()
     }
     
     start = time.time()
-    response = httpx.post(
-        f"{llm_integration.OPENAI_API_BASE}/completions",
-        json=payload,
-        timeout=llm_integration.TIMEOUT
-    )
-    response.raise_for_status()
-    raw = response.json()["choices"][0]["text"].strip()
+    raw = llm_client.complete(payload, timeout=llm_integration.TIMEOUT)
     end = time.time()
 
     state["llm_raw_reply"] = raw
@@ -129,39 +129,24 @@ def parse_llm_response(state):
 
 ### STEP 7: Store thoughts, update mood, cache result
 
+def persist_turn_memories(parsed, user_msg):
+    """Post-response stage (after the reply on a persistent server, see post_response)"""
+    thought_log.append(parsed["thoughts"], user_msg)
+
+    if parsed["mood"]:
+        mood_state.set_current_mood(parsed["mood"])
+
+    memory_state.extract_and_save_memories(user_msg, parsed["main_text"])
+
+
 def update_memory_and_cache(state):
     parsed = state["parsed"]
     user_msg = state["user_message"]
 
-    for i, thought in enumerate(parsed["thoughts"]):
-        key = f"thought_{datetime.datetime.now().isoformat()}_{i}"
-        memory_state.save_memory(
-            memory_type=memory_state.MEMORY_TYPES["INTERACTION"],
-            key=key,
-            value=f"Thought: {thought}",
-            importance=7,
-            source="thought_extraction"
-        )
-
-    if parsed["mood"]:
-        key = f"mood_{datetime.datetime.now().isoformat()}"
-        memory_state.save_memory(
-            memory_type=memory_state.MEMORY_TYPES["EMOTIONAL"],
-            key=key,
-            value=parsed["mood"],
-            importance=6,
-            source="mood_extraction"
-        )
-
     memory_state.conversation_memory.append({"role": "assistant", "content": parsed["main_text"]})
-    memory_state.extract_and_save_memories(user_msg, parsed["main_text"])
+    post_response.submit(persist_turn_memories, parsed, user_msg)
 
-    resp_id = f"resp_{int(time.time())}_{hash(user_msg) % 10000}"
-    response_cache[resp_id] = {
-        "raw_reply": state["llm_raw_reply"],
-        "parsed": parsed,
-        "timestamp": time.time()
-    }
+    resp_id = response_cache.put({"raw_reply": state["llm_raw_reply"], "parsed": parsed})
 
     state["final_response"] = {
         "status": "success",
@@ -178,6 +163,7 @@ def update_memory_and_cache(state):
 import anvil.server
 
 @anvil.server.callable
+@memory_state.batched_memory_writes
 def chat_pipeline(user_message):
     state = {"user_message": user_message}
     try:
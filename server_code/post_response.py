@@ -0,0 +1,111 @@
+# post_response.py
+import threading
+import time
+import traceback
+from collections import deque
+
+from . import memory_state
+
+# Set to True only when the app runs with Anvil's persistent server option,
+# so module state and threads outlive the server call that started them
+PERSISTENT_SERVER = False
+
+# "inline": run post-response work before the call returns. "thread": run it
+# on a per-conversation worker thread after the reply has been returned; only
+# used when PERSISTENT_SERVER is set, as otherwise the thread (and its
+# writes) can be lost once the call returns.
+POST_RESPONSE_MODE = "inline"
+
+# How long a new turn waits for the previous turn's post-processing before
+# it reads memories (normally that work finished while the user was typing)
+BARRIER_TIMEOUT = 5.0
+
+DEFAULT_CONVERSATION_ID = "default"
+
+_lock = threading.Condition()
+_queues = {}  # conversation_id -> deque of pending jobs
+_running = set()  # conversations whose worker thread is alive
+stats = {"submitted": 0, "completed": 0, "failed": 0, "total_seconds": 0.0}
+
+
+def submit(func, *args, conversation_id=DEFAULT_CONVERSATION_ID, **kwargs):
+    """
+    Queue func(*args, **kwargs) to run after the reply has been sent.
+
+    Jobs for the same conversation run one at a time in submission order,
+    each inside its own memory_batch so its table writes flush together.
+    Different conversations are processed independently.
+    """
+    job = (func, args, kwargs)
+    with _lock:
+        stats["submitted"] += 1
+    if not threaded():
+        _run_job(job)
+        return
+
+    with _lock:
+        _queues.setdefault(conversation_id, deque()).append(job)
+        if conversation_id in _running:
+            return
+        _running.add(conversation_id)
+
+    threading.Thread(target=_drain, args=(conversation_id,), daemon=True).start()
+
+
+def threaded():
+    """Whether submitted work runs on a worker thread after the reply"""
+    return POST_RESPONSE_MODE == "thread" and PERSISTENT_SERVER
+
+
+def _run_job(job):
+    func, args, kwargs = job
+    start = time.time()
+    outcome = "completed"
+    try:
+        with memory_state.memory_batch():
+            func(*args, **kwargs)
+    except Exception as e:
+        outcome = "failed"
+        print(f"Post-response job {getattr(func, '__name__', func)} failed: {e}")
+        traceback.print_exc()
+    with _lock:
+        stats[outcome] += 1
+        stats["total_seconds"] += time.time() - start
+
+
+def _drain(conversation_id):
+    while True:
+        with _lock:
+            queue = _queues.get(conversation_id)
+            if not queue:
+                _queues.pop(conversation_id, None)
+                _running.discard(conversation_id)
+                _lock.notify_all()
+                return
+            job = queue.popleft()
+        _run_job(job)
+
+
+def wait(conversation_id=DEFAULT_CONVERSATION_ID, timeout=BARRIER_TIMEOUT):
+    """
+    Block until queued work for a conversation has finished (or timeout).
+    Called at the start of a turn so it reads the previous turn's writes.
+    Returns True if the queue is idle.
+    """
+    deadline = time.time() + timeout
+    with _lock:
+        while conversation_id in _running:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"Post-response work for {conversation_id} still running, continuing anyway")
+                return False
+            _lock.wait(remaining)
+    return True
+
+
+def pending(conversation_id=None):
+    """Number of queued jobs, for one conversation or in total"""
+    with _lock:
+        if conversation_id is not None:
+            return len(_queues.get(conversation_id, ()))
+        return sum(len(queue) for queue in _queues.values())
@@ -2,6 +2,13 @@
 import jinja2
 import os
 
+# "stable_prefix": the system message holds only the persona and never
+# changes, and each turn's mood and memories are rendered after the
+# history, so the inference server can reuse its cached prefix (KV cache)
+# for the whole conversation. "system_context": mood and memories are
+# rewritten inside the system message every turn.
+PROMPT_LAYOUT = "stable_prefix"
+
 # Enhanced template that handles memory inclusion
 PROMPT_TEMPLATE = """
 <bos>
@@ -21,6 +28,11 @@ PROMPT_TEMPLATE = """
 {{ message['content'] | trim }}
 <end_of_turn>
 {%- endfor %}
+{%- if context %}
+  <start_of_turn>user
+{{ context | trim }}
+<end_of_turn>
+{%- endif %}
 
 <start_of_turn>model
 """
@@ -33,12 +45,31 @@ jinja_env = jinja2.Environment(
 
 template = jinja_env.from_string(PROMPT_TEMPLATE)
 
-def build_prompt(messages):
+def build_prompt(messages, context=None):
     """
     Build prompt from messages with enhanced memory handling.
-    The system message should already have memories incorporated.
+    The system message should already have memories incorporated, unless
+    they are passed as `context` (see dynamic_context), which is rendered
+    after the conversation history.
     """
-    return template.render(messages=messages)
+    return template.render(messages=messages, context=context)
+
+
+def stable_prefix_layout():
+    return PROMPT_LAYOUT == "stable_prefix"
+
+
+def dynamic_context(mood=None, memories=None):
+    """The per-turn context block for the stable_prefix layout, or None if empty"""
+    parts = []
+    if mood:
+        parts.append(f"CURRENT MOOD: You are currently feeling {mood}.")
+    if memories:
+        parts.append("RELEVANT MEMORIES:\n" + "\n".join(
+            f"- {memory['type'].upper()}: {memory['value']}" for memory in memories))
+    if not parts:
+        return None
+    return "[Context for your next reply, not written by the user]\n" + "\n\n".join(parts)
 
 
 # Alternative: Memory-focused prompt template
@@ -0,0 +1,80 @@
+# query_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# Cached memory listings. Entries are invalidated by writes made through
+# memory_state; the TTL bounds how stale a listing can get when another
+# server process writes to the same table.
+QUERY_CACHE_TTL = 300  # seconds
+QUERY_CACHE_SIZE = 32
+
+
+class QueryCache:
+    """
+    Versioned read-through cache for memory queries.
+
+    Every memory type has a version number that writes bump. A cached
+    result remembers the versions it was read at: a result filtered to one
+    type is only invalidated by writes to that type, an unfiltered result
+    by any write. Results are also dropped after `ttl` seconds and the
+    least recently used entry is evicted beyond `capacity`.
+    """
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, capacity=QUERY_CACHE_SIZE):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._versions = {}  # memory_type -> version
+        self._generation = 0  # Bumped by any write (the version of unfiltered queries)
+        self._epoch = 0  # Bumped by clear()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()  # (memory_type, key) -> (version, stored_at, result)
+            self._generation += 1
+            self._epoch += 1
+            self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _version(self, memory_type):
+        if memory_type is None:
+            return self._generation
+        return (self._epoch, self._versions.get(memory_type, 0))
+
+    def get(self, memory_type, key, loader):
+        """
+        Cached result of `loader()` for a query over `memory_type` (None for
+        all types), identified by the hashable `key`.
+        """
+        cache_key = (memory_type, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if (entry is not None and entry[0] == self._version(memory_type)
+                    and time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.stats["misses"] += 1
+            version = self._version(memory_type)
+
+        result = loader()
+        with self._lock:
+            # A write during the load leaves the version changed, so the
+            # result is returned but not kept
+            if version == self._version(memory_type):
+                self._entries[cache_key] = (version, time.monotonic(), result)
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self, memory_type):
+        """Note a write to `memory_type`: results that could include it are now stale"""
+        with self._lock:
+            self._versions[memory_type] = self._versions.get(memory_type, 0) + 1
+            self._generation += 1
+            self.stats["invalidations"] += 1
@@ -0,0 +1,123 @@
+# response_cache.py
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import anvil.server
+
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600  # seconds
+
+# Only requests sampled at or below this temperature are answered from the
+# cache (e.g. memory extraction and summaries); chat replies are sampled
+# and are only kept so they can be fetched again by response id
+CACHEABLE_MAX_TEMPERATURE = 0.3
+
+# Payload fields that don't change what the model generates
+_IGNORED_FIELDS = ("prompt", "stream", "stream_options", "cache_prompt", "id_slot")
+
+
+def prompt_key(payload):
+    """Hash of the model, the whitespace-normalised prompt and the sampling parameters"""
+    params = {key: value for key, value in payload.items() if key not in _IGNORED_FIELDS}
+    prompt = " ".join((payload.get("prompt") or "").split())
+    blob = json.dumps([prompt, params], sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def cacheable(payload):
+    temperature = payload.get("temperature")
+    return temperature is not None and temperature <= CACHEABLE_MAX_TEMPERATURE
+
+
+class ResponseCache:
+    """
+    Bounded cache of LLM responses, reachable by response id and (for
+    cacheable requests) by prompt_key. Entries expire after `ttl` seconds;
+    beyond `capacity` the least recently used entry is evicted.
+    """
+
+    def __init__(self, capacity=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()  # response_id -> entry
+            self._by_prompt = {}  # prompt_key -> response_id
+            self.stats = {"id_hits": 0, "id_misses": 0, "prompt_hits": 0, "prompt_misses": 0, "evictions": 0}
+
+    def _drop(self, response_id):
+        entry = self._entries.pop(response_id)
+        if entry.get("prompt_key") and self._by_prompt.get(entry["prompt_key"]) == response_id:
+            del self._by_prompt[entry["prompt_key"]]
+
+    def _live(self, response_id):
+        """The entry for response_id if present and not expired (caller holds the lock)"""
+        entry = self._entries.get(response_id)
+        if entry is None:
+            return None
+        if time.time() - entry["timestamp"] >= self.ttl:
+            self._drop(response_id)
+            return None
+        self._entries.move_to_end(response_id)
+        return entry
+
+    def put(self, entry, payload=None, response_id=None):
+        """
+        Store a response (a dict, e.g. {"raw_reply", "parsed"}) and return
+        its response id. With the request payload, a cacheable request can
+        later be answered by lookup().
+        """
+        response_id = response_id or f"resp_{uuid.uuid4().hex}"
+        entry = dict(entry, timestamp=time.time())
+        if payload is not None and cacheable(payload):
+            entry["prompt_key"] = prompt_key(payload)
+        with self._lock:
+            if response_id in self._entries:
+                self._drop(response_id)
+            self._entries[response_id] = entry
+            if entry.get("prompt_key"):
+                self._by_prompt[entry["prompt_key"]] = response_id
+            while len(self._entries) > self.capacity:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+        return response_id
+
+    def get(self, response_id):
+        with self._lock:
+            entry = self._live(response_id)
+            self.stats["id_hits" if entry else "id_misses"] += 1
+            return entry
+
+    def lookup(self, payload):
+        """The cached response to an identical cacheable request, or None"""
+        if not cacheable(payload):
+            return None
+        key = prompt_key(payload)
+        with self._lock:
+            response_id = self._by_prompt.get(key)
+            entry = self._live(response_id) if response_id else None
+            self.stats["prompt_hits" if entry else "prompt_misses"] += 1
+            return entry
+
+
+default_cache = ResponseCache()
+
+
+@anvil.server.callable
+def get_response_cache_stats():
+    """Response cache size and hit rates by response id and by prompt"""
+    stats = dict(default_cache.stats)
+    id_lookups = stats["id_hits"] + stats["id_misses"]
+    prompt_lookups = stats["prompt_hits"] + stats["prompt_misses"]
+    return dict(stats, cached_responses=len(default_cache), capacity=default_cache.capacity,
+                id_hit_rate=stats["id_hits"] / id_lookups if id_lookups else None,
+                prompt_hit_rate=stats["prompt_hits"] / prompt_lookups if prompt_lookups else None)
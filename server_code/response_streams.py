@@ -0,0 +1,131 @@
+# response_streams.py
+import time
+import anvil.server
+
+from . import memory_state
+
+# A streamed reply is generated in a background task (see chat_stream_task)
+# and published through its task_state, which the client polls. The text is
+# republished at most this often while tokens arrive.
+STREAM_PUBLISH_INTERVAL = 0.2  # Seconds
+
+# Tags whose content is not shown while a reply streams; the final parsed
+# reply (see parse_special_tags) replaces the streamed text once complete
+HIDDEN_TAGS = ("thought", "mood", "image")
+
+
+class VisibleTextFilter:
+    """
+    Incrementally drops hidden tags (and their content) from streamed text.
+    Text that might be the start of a tag is held back until it is decided.
+    """
+
+    def __init__(self, tags=HIDDEN_TAGS):
+        self._openers = {f"<{tag}>": f"</{tag}>" for tag in tags}
+        self._pending = ""
+        self._closer = None  # Closing tag we are waiting for inside a hidden tag
+
+    def feed(self, text):
+        self._pending += text
+        visible = []
+        while self._pending:
+            if self._closer:
+                end = self._pending.find(self._closer)
+                if end == -1:
+                    # Keep just enough to recognise a closing tag split across chunks
+                    self._pending = self._pending[-(len(self._closer) - 1):]
+                    break
+                self._pending = self._pending[end + len(self._closer):]
+                self._closer = None
+                continue
+
+            start = self._pending.find("<")
+            if start == -1:
+                visible.append(self._pending)
+                self._pending = ""
+                break
+            visible.append(self._pending[:start])
+            self._pending = self._pending[start:]
+            opener = next((o for o in self._openers if self._pending.startswith(o)), None)
+            if opener:
+                self._closer = self._openers[opener]
+                self._pending = self._pending[len(opener):]
+            elif any(o.startswith(self._pending) for o in self._openers):
+                break  # Could still become a hidden tag
+            else:
+                visible.append("<")
+                self._pending = self._pending[1:]
+        return "".join(visible)
+
+    def flush(self):
+        """Whatever was held back, once the stream has ended"""
+        rest = "" if self._closer else self._pending
+        self._pending = ""
+        return rest
+
+
+class ResponseStream:
+    """
+    Visible text of one reply as it streams, published to `state` (the
+    background task's task_state) for read_response_stream.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.started_at = time.time()
+        self.first_token_at = None
+        self._published_at = 0.0
+        self._text = ""
+        self._filter = VisibleTextFilter()
+        self._publish(done=False)
+
+    def _publish(self, **fields):
+        self.state.update(text=self._text, **fields)
+        self._published_at = time.time()
+
+    def append(self, token):
+        """Add a raw token from the model"""
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+        self._text += self._filter.feed(token)
+        if time.time() - self._published_at >= STREAM_PUBLISH_INTERVAL:
+            self._publish()
+
+    def finish(self):
+        self._text += self._filter.flush()
+        self._publish(done=True)
+
+    def fail(self, error):
+        self._publish(done=True, error=str(error))
+
+    def time_to_first_token(self):
+        return self.first_token_at - self.started_at if self.first_token_at else None
+
+
+@anvil.server.callable
+def read_response_stream(stream_id, offset=0):
+    """
+    Poll a streamed reply (stream_id is its background task's id): new text
+    after `offset`, plus the parsed result once done
+    """
+    task = anvil.server.get_background_task(stream_id)
+    state = task.get_state() or {}
+    text = state.get("text") or ""
+    termination = task.get_termination_status()  # None while running
+    error = state.get("error")
+    if termination not in (None, "completed"):
+        error = error or f"Reply generation {termination}"
+    result = None
+    if termination == "completed" and error is None:
+        result = dict(task.get_return_value())
+        # The turn ran in the task's interpreter; take over its conversation history
+        conversation = result.pop("conversation", None)
+        if conversation is not None:
+            memory_state.conversation_memory[:] = conversation
+    return {
+        "text": text[offset:],
+        "offset": len(text),
+        "done": termination is not None or error is not None,
+        "result": result,
+        "error": error,
+    }
@@ -0,0 +1,106 @@
+# thought_log.py
+import datetime
+import threading
+import time
+from collections import deque
+import anvil.server
+
+from . import memory_state
+from .keyword_index import BM25Index
+from .memory_decay import utc_now
+
+# Thoughts are kept in the "thoughts" log of the memory storage backend
+THOUGHT_LOG = "thoughts"
+# Retention: thoughts beyond either limit are deleted by maintenance
+THOUGHT_LOG_LIMIT = 2000
+THOUGHT_RETENTION_DAYS = 30
+# Most recent thoughts kept in RAM for replay and search
+THOUGHT_WINDOW = 500
+THOUGHT_CONTEXT_CHARS = 200  # Excerpt of the user message stored with a thought
+RETENTION_BATCH_SIZE = 100  # Rows deleted per batch while enforcing retention
+
+_lock = threading.Lock()
+_window = deque(maxlen=THOUGHT_WINDOW)  # {"id", "thought", "context", "created_at"}, oldest first
+_index = BM25Index()  # Over the thoughts in _window
+_loaded_from = None  # Backend the window was filled from
+_next_id = 0
+
+
+def _remember(thought, context, created_at):
+    """Add a thought to the in-RAM window (caller holds _lock)"""
+    global _next_id
+    if len(_window) == _window.maxlen:
+        _index.remove(_window[0]["id"])
+    entry = {"id": _next_id, "thought": thought, "context": context, "created_at": created_at}
+    _next_id += 1
+    _window.append(entry)
+    _index.add(entry["id"], thought)
+
+
+def _load():
+    """Fill the window with the newest stored thoughts (once per process and backend)"""
+    global _loaded_from
+    if _loaded_from is memory_state.backend:
+        return
+    _loaded_from = memory_state.backend
+    _window.clear()
+    _index.clear()
+    for entry in _loaded_from.log_read(THOUGHT_LOG, THOUGHT_WINDOW, newest=True):
+        _remember(entry["thought"], entry["context"], entry["created_at"])
+
+
+def append(thoughts, user_message=""):
+    """
+    Append one turn's thoughts to the log (one storage write for the batch).
+    The window is only kept up to date once a read has loaded it.
+    """
+    if not thoughts:
+        return
+    now = datetime.datetime.now()
+    context = (user_message or "")[:THOUGHT_CONTEXT_CHARS]
+    memory_state.backend.log_append(THOUGHT_LOG, [
+        {"created_at": now, "thought": thought, "context": context} for thought in thoughts
+    ])
+    with _lock:
+        if _loaded_from is memory_state.backend:
+            for thought in thoughts:
+                _remember(thought, context, now)
+    print(f"Logged {len(thoughts)} thoughts")
+
+
+def _as_dict(entry):
+    return {"thought": entry["thought"], "context": entry["context"], "created_at": entry["created_at"]}
+
+
+@anvil.server.callable
+def get_recent_thoughts(limit=10):
+    """Most recent thoughts, oldest first, for replaying character continuity"""
+    with _lock:
+        _load()
+        return [_as_dict(entry) for entry in list(_window)[-limit:]]
+
+
+@anvil.server.callable
+def search_thoughts(query, limit=5):
+    """Recent thoughts matching a query (keyword relevance), best first"""
+    with _lock:
+        _load()
+        by_id = {entry["id"]: entry for entry in _window}
+        return [_as_dict(by_id[doc_id]) for score, doc_id in _index.search(query, limit) if score > 0]
+
+
+def enforce_retention(deadline=None):
+    """
+    Delete logged thoughts older than THOUGHT_RETENTION_DAYS or beyond the
+    newest THOUGHT_LOG_LIMIT, in batches until done or the deadline passes.
+    Returns (deleted, finished).
+    """
+    cutoff = utc_now() - datetime.timedelta(days=THOUGHT_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        batch = memory_state.backend.log_trim(THOUGHT_LOG, cutoff, THOUGHT_LOG_LIMIT, RETENTION_BATCH_SIZE)
+        deleted += batch
+        if batch < RETENTION_BATCH_SIZE:
+            return deleted, True
+        if deadline is not None and time.time() >= deadline:
+            return deleted, False
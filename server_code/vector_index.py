@@ -0,0 +1,162 @@
+# vector_index.py
+import hashlib
+import math
+from collections import Counter
+
+from .keyword_index import tokenize
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# Width of the local hashing embeddings
+EMBEDDING_DIM = 256
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder (feature hashing with sublinear TF weights).
+
+    Tokens and adjacent token pairs are hashed into `dim` signed buckets and
+    the result is L2-normalised, so a dot product between two vectors is
+    their cosine similarity. No model or network access is needed, and the
+    same text always produces the same vector across processes.
+
+    Any object with a `dim` attribute and an `embed(texts)` method returning
+    an (n, dim) float32 array can be used in its place.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = Counter(tokens)
+            features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+            for feature, tf in features.items():
+                bucket, sign = self._bucket(feature)
+                vectors[row, bucket] += sign * (1.0 + math.log(tf))
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """
+    Dense vector index over memories.
+
+    All vectors live in one contiguous float32 matrix (grown by doubling), so
+    a query is a single matrix-vector product followed by argpartition for
+    the top-k. Removal swaps the last row into the freed slot to keep the
+    matrix dense.
+    """
+
+    def __init__(self, embedder=None, initial_capacity=1024):
+        if not HAS_NUMPY:
+            raise RuntimeError("VectorIndex requires numpy")
+        self.embedder = embedder or HashingEmbedder()
+        self._initial_capacity = initial_capacity
+        self.clear()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._rows
+
+    def doc_ids(self, limit=None):
+        return self._ids[:limit]
+
+    def clear(self):
+        self._matrix = np.zeros((self._initial_capacity, self.embedder.dim), dtype=np.float32)
+        self._ids = []  # row -> doc_id
+        self._rows = {}  # doc_id -> row
+
+    def set_embedder(self, embedder):
+        """Swap the embedder. The index is emptied and must be rebuilt."""
+        self.embedder = embedder
+        self.clear()
+
+    def vectors(self):
+        """View of the live rows of the matrix"""
+        return self._matrix[:len(self._ids)]
+
+    def vector(self, doc_id):
+        row = self._rows.get(doc_id)
+        return None if row is None else self._matrix[row]
+
+    def _reserve(self, size):
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.zeros((capacity, self._matrix.shape[1]), dtype=np.float32)
+        grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = grown
+
+    def add(self, doc_id, text):
+        self.add_many([(doc_id, text)])
+
+    def add_many(self, items):
+        """Embed and store a batch of (doc_id, text) pairs"""
+        items = list(items)
+        if not items:
+            return
+        vectors = self.embedder.embed([text for _, text in items])
+        self.add_vectors([doc_id for doc_id, _ in items], vectors)
+
+    def add_vectors(self, doc_ids, vectors):
+        """Store precomputed vectors, replacing existing ones with the same id"""
+        self._reserve(len(self._ids) + len(doc_ids))
+        for doc_id, vector in zip(doc_ids, vectors):
+            row = self._rows.get(doc_id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(doc_id)
+                self._rows[doc_id] = row
+            self._matrix[row] = vector
+
+    def remove(self, doc_id):
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return False
+
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved
+            self._rows[moved] = row
+        self._ids.pop()
+        return True
+
+    def search_vector(self, query_vector, limit=5):
+        """Return up to `limit` (score, doc_id) pairs for a query vector, best first"""
+        count = len(self._ids)
+        if not count or limit <= 0:
+            return []
+
+        scores = self._matrix[:count] @ query_vector
+        if limit < count:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(count)
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[row]), self._ids[row]) for row in top]
+
+    def search(self, query, limit=5):
+        """Return up to `limit` (score, doc_id) pairs for a text query, best first"""
+        if not self._ids:
+            return []
+        return self.search_vector(self.embedder.embed([query])[0], limit)